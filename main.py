@@ -1,49 +1,152 @@
 import os
 import json
+import multiprocessing
+import queue
 import sys
+import threading
 import traceback
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Optional, Tuple
 
 # Import utility modules
-from utils.extractor import DocumentExtractor
-from utils.scorer import SectionScorer
-from utils.summarizer import SubSectionSummarizer
+from utils.cache import EmbeddingCache, ExtractionCache, SummaryCache
+from utils.extractor import (
+    EXTRACTION_MODES, HEADING_DETECTORS, count_pages, document_font_statistics, extract_document,
+    extract_page_range, extractor_fingerprint, iter_document, merge_page_shards, page_shards
+)
+from utils.language import Section
 
 class PersonaDrivenAnalyzer:
     """Main analyzer that orchestrates the persona-driven document intelligence"""
     
-    def __init__(self):
-        self.ranker = SectionScorer()
-        self.summarizer = SubSectionSummarizer()
+    def __init__(self, extraction_workers: int = 1, pages_per_shard: int = 0,
+                 extraction_cache_dir: Optional[str] = None, extraction_cache_mb: int = 512,
+                 pipeline: bool = False, encode_batch_size: int = 64,
+                 normalize_titles: bool = False, heading_detector: str = "text",
+                 extraction_mode: str = "rich", max_document_mb: int = 256,
+                 embedding_cache_path: Optional[str] = None, embedding_cache_mb: int = 1024,
+                 embedding_batch_size: int = 32, max_seq_length: Optional[int] = None,
+                 encoder_backend: str = "torch", onnx_model_dir: Optional[str] = None,
+                 lexical_top_n: int = 0, lexical_weight: float = 0.3,
+                 ann_index: str = "exact", ann_exact_threshold: int = 50000,
+                 ann_index_dir: Optional[str] = None, passage_tokens: int = 0,
+                 passage_top_m: int = 1, max_section_chars: Optional[int] = None,
+                 encode_workers: int = 0, threads_per_worker: Optional[int] = None,
+                 summary_batch_size: int = 4, summary_cache_dir: Optional[str] = None,
+                 summary_cache_mb: int = 64, summary_engine: str = "abstractive",
+                 summary_input_tokens: int = 256, persona_prompt: str = "compact",
+                 summary_backend: str = "torch", summary_onnx_dir: Optional[str] = None):
+        # Imported here rather than at module level: spawned extraction
+        # workers re-import this module and must not load torch or the models
+        from utils.scorer import SectionScorer
+        from utils.summarizer import SUMMARY_ENGINES, ExtractiveSummarizer, SubSectionSummarizer
+
+        # Checked here, before any model loads, rather than once per document
+        # inside the extraction workers
+        if heading_detector not in HEADING_DETECTORS:
+            raise ValueError(f"Unknown heading detector: {heading_detector}")
+        if extraction_mode not in EXTRACTION_MODES:
+            raise ValueError(f"Unknown extraction mode: {extraction_mode}")
+
+        embedding_cache = None
+        if embedding_cache_path:
+            embedding_cache = EmbeddingCache(
+                embedding_cache_path, max_bytes=int(embedding_cache_mb) * 1024 * 1024
+            )
+        self.ranker = SectionScorer(
+            embedding_cache=embedding_cache,
+            batch_size=max(1, int(embedding_batch_size)),
+            max_seq_length=max_seq_length,
+            backend=encoder_backend,
+            onnx_dir=onnx_model_dir,
+            lexical_top_n=max(0, int(lexical_top_n)),
+            lexical_weight=float(lexical_weight),
+            ann_index=ann_index,
+            ann_exact_threshold=int(ann_exact_threshold),
+            ann_index_dir=ann_index_dir,
+            passage_tokens=max(0, int(passage_tokens)),
+            passage_top_m=max(1, int(passage_top_m)),
+            encode_workers=max(0, int(encode_workers)),
+            threads_per_worker=int(threads_per_worker) if threads_per_worker else None
+        )
+        self.embedding_cache = embedding_cache
+        if summary_engine not in SUMMARY_ENGINES:
+            raise ValueError(f"Unknown summary engine: {summary_engine}")
+        if summary_engine == "extractive":
+            # Reuses the section encoder; DistilBART is never loaded
+            self.summarizer = ExtractiveSummarizer(self.ranker)
+        else:
+            summary_cache = None
+            if summary_cache_dir:
+                summary_cache = SummaryCache(summary_cache_dir, max_bytes=int(summary_cache_mb) * 1024 * 1024)
+            self.summarizer = SubSectionSummarizer(
+                batch_size=int(summary_batch_size), cache=summary_cache,
+                input_tokens=int(summary_input_tokens), persona_prompt=persona_prompt,
+                backend=summary_backend, onnx_dir=summary_onnx_dir
+            )
+        # Number of processes used to extract documents; 1 keeps extraction in-process
+        self.extraction_workers = max(1, int(extraction_workers))
+        # Started on first use and kept until close(), so repeated collections
+        # do not pay for new worker processes
+        self.extraction_pool = None
+        # Documents longer than this are split into page ranges across workers; 0 disables
+        self.pages_per_shard = max(0, int(pages_per_shard))
+        # Passed to every DocumentExtractor, including those in worker processes
+        self.extractor_options = {
+            "normalize_titles": normalize_titles,
+            "heading_detector": heading_detector,
+            "extraction_mode": extraction_mode,
+            # Larger PDFs are processed page-at-a-time; 0 disables the ceiling
+            "max_document_mb": int(max_document_mb),
+            # Passage scoring reads whole sections unless a limit is given
+            "max_section_chars": int(
+                max_section_chars if max_section_chars is not None else (0 if passage_tokens else 500)
+            )
+        }
+        self.extraction_cache = None
+        if extraction_cache_dir:
+            self.extraction_cache = ExtractionCache(
+                extraction_cache_dir,
+                max_bytes=int(extraction_cache_mb) * 1024 * 1024,
+                fingerprint=extractor_fingerprint(self.extractor_options)
+            )
+        # Embed sections in micro-batches while extraction is still running
+        self.pipeline = pipeline
+        self.encode_batch_size = max(1, int(encode_batch_size))
     
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """Stops the extraction and encode worker processes and closes the embedding cache."""
+        if self.extraction_pool is not None:
+            self.extraction_pool.shutdown(wait=True, cancel_futures=True)
+            self.extraction_pool = None
+        self.ranker.close()
+        if self.embedding_cache is not None:
+            self.embedding_cache.close()
+            self.embedding_cache = None
+
     def process_collection(self, pdf_paths: List[str], persona: str, job_description: str) -> Dict[str, Any]:
         print(f"Processing {len(pdf_paths)} documents for persona: {persona}")
         print(f"Job to be done: {job_description}")
         
         print("\n1. Extracting sections from documents...")
-        all_sections = []
-        
-        for pdf_path in pdf_paths:
-            try:
-                print(f"   Processing: {os.path.basename(pdf_path)}")
-                extractor = DocumentExtractor(pdf_path)
-                sections = extractor.extract_sections()
-                all_sections.extend(sections)
-                print(f"   ✓ Extracted {len(sections)} sections")
-            except Exception as e:
-                print(f"   ✗ Error processing {pdf_path}: {str(e)}")
-                continue
-        
-        if not all_sections:
-            raise Exception("No sections could be extracted from any document")
-        
-        print(f"Total sections extracted: {len(all_sections)}")
+        all_sections, section_embeddings = self._extract_for_ranking(pdf_paths)
         
         print("\n2. Ranking sections by relevance...")
-        ranked_sections = self.ranker.rank_sections(all_sections, persona, job_description)
-        top_sections = ranked_sections[:20]
+        if section_embeddings is not None:
+            top_sections = self.ranker.rank_encoded(
+                all_sections, section_embeddings, persona, job_description, top_k=20
+            )
+        else:
+            top_sections = self.ranker.rank_sections(all_sections, persona, job_description, top_k=20)
         print(f"Selected top {len(top_sections)} most relevant sections")
         
         print("\n3. Analyzing sub-sections...")
@@ -61,6 +164,209 @@ class PersonaDrivenAnalyzer:
         
         return result
     
+    def process_collection_multi(self, pdf_paths: List[str],
+                                 queries: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """
+        Analyzes one collection for many (persona, job_description) pairs.
+
+        Documents are extracted and embedded once; all queries are ranked
+        together in one batch. Returns one result per query, in order.
+        """
+        print(f"Processing {len(pdf_paths)} documents for {len(queries)} personas")
+
+        print("\n1. Extracting sections from documents...")
+        all_sections, section_embeddings = self._extract_for_ranking(pdf_paths)
+
+        print(f"\n2. Ranking sections for {len(queries)} personas...")
+        if section_embeddings is not None:
+            rankings = self.ranker.rank_encoded_multi(all_sections, section_embeddings, queries, top_k=20)
+        else:
+            rankings = self.ranker.rank_sections_multi(all_sections, queries, top_k=20)
+
+        results = []
+        for (persona, job_description), top_sections in zip(queries, rankings):
+            print(f"\n3. Analyzing sub-sections for persona: {persona}")
+            sub_section_analysis = self.summarizer.extract_subsections(
+                top_sections[:10], persona, job_description
+            )
+            results.append(self._format_output(
+                pdf_paths, persona, job_description,
+                top_sections, sub_section_analysis
+            ))
+
+        print(f"✓ Analysis complete for {len(results)} personas")
+        return results
+
+    def _extract_for_ranking(self, pdf_paths: List[str]) -> Tuple[List[Dict], Any]:
+        """
+        Returns all extracted sections, plus their embeddings when the
+        pipelined path already computed them (None otherwise).
+        """
+        section_embeddings = None
+        # The BM25 prefilter and passage scoring decide what gets encoded, so
+        # they need every section before encoding starts
+        if self.pipeline and not (self.ranker.lexical_top_n or self.ranker.passage_tokens):
+            all_sections, section_embeddings = self._extract_and_encode(pdf_paths)
+        else:
+            all_sections = self._extract_all(pdf_paths)
+        
+        if not all_sections:
+            raise Exception("No sections could be extracted from any document")
+        
+        print(f"Total sections extracted: {len(all_sections)}")
+        return all_sections, section_embeddings
+
+    def _extract_all(self, pdf_paths: List[str]) -> List[Dict]:
+        extracted = []
+        failed = set()
+
+        for doc_index, section in self._stream_sections(pdf_paths):
+            if section is None:
+                failed.add(doc_index)
+            else:
+                extracted.append((doc_index, section))
+
+        return [section for doc_index, section in extracted if doc_index not in failed]
+
+    def _extract_and_encode(self, pdf_paths: List[str]) -> Tuple[List[Dict], Any]:
+        """
+        Extracts on a background thread while this thread embeds the sections
+        in micro-batches, so encoding overlaps with PDF parsing.
+        """
+        stream = queue.Queue(maxsize=4 * self.encode_batch_size)
+        end_of_stream = object()
+        producer_error = []
+
+        def produce():
+            try:
+                for item in self._stream_sections(pdf_paths):
+                    stream.put(item)
+            except BaseException as e:
+                producer_error.append(e)
+            finally:
+                stream.put(end_of_stream)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+
+        sections, doc_indices, embedding_batches, batch = [], [], [], []
+        failed = set()
+        while True:
+            item = stream.get()
+            if item is end_of_stream or len(batch) >= self.encode_batch_size:
+                if batch:
+                    embedding_batches.append(self.ranker.encode_sections(batch))
+                    sections.extend(batch)
+                    batch = []
+            if item is end_of_stream:
+                break
+
+            doc_index, section = item
+            if section is None:
+                failed.add(doc_index)
+                continue
+            batch.append(section)
+            doc_indices.append(doc_index)
+
+        producer.join()
+        if producer_error:
+            raise producer_error[0]
+        if not sections:
+            return [], None
+
+        # Drop anything already embedded for documents that failed part-way
+        keep = [idx for idx, doc_index in enumerate(doc_indices) if doc_index not in failed]
+        embeddings = self.ranker.join_embeddings(embedding_batches, keep)
+        return [sections[idx] for idx in keep], embeddings
+
+    def _stream_sections(self, pdf_paths: List[str]) -> Iterator[Tuple[int, Optional[Dict]]]:
+        """
+        Yields (document index, section) pairs in input order, so the section
+        order does not depend on which worker finishes first. A None section
+        marks a failed document; sections already yielded for it must be
+        discarded.
+        """
+        jobs = self._extraction_jobs(pdf_paths)
+        for doc_index, (pdf_path, load_sections) in enumerate(jobs):
+            count = 0
+            try:
+                print(f"   Processing: {os.path.basename(pdf_path)}")
+                for section in load_sections():
+                    count += 1
+                    yield doc_index, section
+                print(f"   ✓ Extracted {count} sections")
+            except Exception as e:
+                print(f"   ✗ Error processing {pdf_path}: {str(e)}")
+                yield doc_index, None
+
+    def _extraction_jobs(self, pdf_paths: List[str]) -> Iterator[Tuple[str, Callable[[], Iterable[Dict]]]]:
+        if self.extraction_workers <= 1:
+            for pdf_path in pdf_paths:
+                yield pdf_path, self._submit_document(None, pdf_path)
+            return
+
+        if self.extraction_pool is None:
+            # spawn: by now the parent holds torch and the models, and with
+            # pipelining this runs beside encoding threads, so forking is
+            # unsafe. main.py imports no model code at module level, so the
+            # workers only load fitz and the extractor
+            spawn = multiprocessing.get_context("spawn")
+            self.extraction_pool = ProcessPoolExecutor(max_workers=self.extraction_workers, mp_context=spawn)
+        jobs = [(pdf_path, self._submit_document(self.extraction_pool, pdf_path)) for pdf_path in pdf_paths]
+        yield from jobs
+
+    def _submit_document(self, pool: Optional[ProcessPoolExecutor], pdf_path: str) -> Callable[[], Iterable[Dict]]:
+        cache_key = None
+        if self.extraction_cache is not None:
+            try:
+                cache_key = self.extraction_cache.key(pdf_path)
+            except OSError:
+                # Unreadable file: extraction reports the error
+                pass
+        if cache_key is not None:
+            cached = self.extraction_cache.load(cache_key, pdf_path)
+            if cached is not None:
+                return lambda: [Section(section) for section in cached]
+
+        load_sections = self._submit_extraction(pool, pdf_path)
+        if cache_key is None:
+            return load_sections
+
+        def load_and_store():
+            sections = []
+            for section in load_sections():
+                sections.append(section)
+                yield section
+            self.extraction_cache.store(cache_key, sections)
+        return load_and_store
+
+    def _submit_extraction(self, pool: Optional[ProcessPoolExecutor], pdf_path: str) -> Callable[[], Iterable[Dict]]:
+        if pool is None:
+            return partial(iter_document, pdf_path, **self.extractor_options)
+
+        shards = [(0, None)]
+        font_stats = None
+        if self.pages_per_shard:
+            try:
+                shards = page_shards(count_pages(pdf_path), self.pages_per_shard)
+                if len(shards) > 1 and self.extractor_options["heading_detector"] == "font":
+                    # Sampled once here instead of again in every shard
+                    font_stats = document_font_statistics(pdf_path, **self.extractor_options)
+            except Exception:
+                # Let the worker raise so the failure is reported with the document
+                pass
+
+        if len(shards) == 1:
+            return pool.submit(extract_document, pdf_path, **self.extractor_options).result
+
+        futures = [
+            pool.submit(extract_page_range, pdf_path, start, stop, font_stats, **self.extractor_options)
+            for start, stop in shards
+        ]
+        return lambda: merge_page_shards(
+            [future.result() for future in futures], self.extractor_options["normalize_titles"]
+        )
+
     def _format_output(self, pdf_paths: List[str], persona: str, job_description: str,
                       sections: List[Dict], sub_sections: List[Dict]) -> Dict[str, Any]:
         return {
@@ -116,6 +422,16 @@ def load_input_config() -> Dict[str, Any]:
 
     return config_data
 
+def config_option(config: Dict[str, Any], key: str, default: Any) -> Any:
+    """Reads an analyzer option from the config file, then the matching env var."""
+    return config.get(key, os.getenv(key.upper(), default))
+
+def config_flag(config: Dict[str, Any], key: str, default: bool) -> bool:
+    value = config_option(config, key, default)
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
 def find_pdf_files(input_dir: Path) -> List[str]:
     pdf_files = list(input_dir.glob("*.pdf"))
 
@@ -155,12 +471,48 @@ def main():
             print(f"  - {os.path.basename(pdf)}")
 
         print("\nInitializing analyzer...")
-        analyzer = PersonaDrivenAnalyzer()
+        analyzer = PersonaDrivenAnalyzer(
+            extraction_workers=int(config_option(config, "extraction_workers", 1)),
+            pages_per_shard=int(config_option(config, "pages_per_shard", 0)),
+            extraction_cache_dir=config_option(config, "extraction_cache_dir", None),
+            extraction_cache_mb=int(config_option(config, "extraction_cache_mb", 512)),
+            pipeline=config_flag(config, "pipeline", False),
+            encode_batch_size=int(config_option(config, "encode_batch_size", 64)),
+            normalize_titles=config_flag(config, "normalize_titles", False),
+            heading_detector=config_option(config, "heading_detector", "text"),
+            extraction_mode=config_option(config, "extraction_mode", "rich"),
+            max_document_mb=int(config_option(config, "max_document_mb", 256)),
+            embedding_cache_path=config_option(config, "embedding_cache_path", None),
+            embedding_cache_mb=int(config_option(config, "embedding_cache_mb", 1024)),
+            embedding_batch_size=int(config_option(config, "embedding_batch_size", 32)),
+            max_seq_length=config_option(config, "max_seq_length", None),
+            encoder_backend=config_option(config, "encoder_backend", "torch"),
+            onnx_model_dir=config_option(config, "onnx_model_dir", None),
+            lexical_top_n=int(config_option(config, "lexical_top_n", 0)),
+            lexical_weight=float(config_option(config, "lexical_weight", 0.3)),
+            ann_index=config_option(config, "ann_index", "exact"),
+            ann_exact_threshold=int(config_option(config, "ann_exact_threshold", 50000)),
+            ann_index_dir=config_option(config, "ann_index_dir", None),
+            passage_tokens=int(config_option(config, "passage_tokens", 0)),
+            passage_top_m=int(config_option(config, "passage_top_m", 1)),
+            max_section_chars=config_option(config, "max_section_chars", None),
+            encode_workers=int(config_option(config, "encode_workers", 0)),
+            threads_per_worker=config_option(config, "threads_per_worker", None),
+            summary_batch_size=int(config_option(config, "summary_batch_size", 4)),
+            summary_cache_dir=config_option(config, "summary_cache_dir", None),
+            summary_cache_mb=int(config_option(config, "summary_cache_mb", 64)),
+            summary_engine=config_option(config, "summary_engine", "abstractive"),
+            summary_input_tokens=int(config_option(config, "summary_input_tokens", 256)),
+            persona_prompt=config_option(config, "persona_prompt", "compact"),
+            summary_backend=config_option(config, "summary_backend", "torch"),
+            summary_onnx_dir=config_option(config, "summary_onnx_dir", None)
+        )
 
         print("\nStarting analysis...")
         start_time = datetime.now()
 
-        result = analyzer.process_collection(pdf_files, persona, job_description)
+        with analyzer:
+            result = analyzer.process_collection(pdf_files, persona, job_description)
 
         end_time = datetime.now()
         processing_time = (end_time - start_time).total_seconds()
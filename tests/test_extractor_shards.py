@@ -0,0 +1,44 @@
+import glob
+import os
+
+import pytest
+
+from utils.extractor import (
+    HEADING_DETECTORS,
+    count_pages,
+    document_font_statistics,
+    extract_document,
+    extract_page_range,
+    merge_page_shards,
+    page_shards,
+)
+
+INPUT_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "input")
+PDF_PATHS = sorted(glob.glob(os.path.join(INPUT_DIR, "*.pdf")))
+
+
+def test_page_shards_cover_every_page_once():
+    for page_count in range(0, 12):
+        for pages_per_shard in range(0, 6):
+            shards = page_shards(page_count, pages_per_shard)
+            pages = [page for start, stop in shards for page in range(start, stop)]
+            assert pages == list(range(page_count))
+
+
+@pytest.mark.parametrize("pdf_path", PDF_PATHS, ids=os.path.basename)
+@pytest.mark.parametrize("heading_detector", HEADING_DETECTORS)
+@pytest.mark.parametrize("normalize_titles", [False, True])
+def test_merged_shards_match_serial_extraction(pdf_path, heading_detector, normalize_titles):
+    options = {"heading_detector": heading_detector, "normalize_titles": normalize_titles}
+    expected = extract_document(pdf_path, **options)
+    page_count = count_pages(pdf_path)
+    font_stats = document_font_statistics(pdf_path, **options)
+
+    for pages_per_shard in (1, 2, 3, 5):
+        # Shards given the document's font statistics, and shards sampling them
+        for shard_font_stats in (font_stats, None):
+            shards = [
+                extract_page_range(pdf_path, start, stop, shard_font_stats, **options)
+                for start, stop in page_shards(page_count, pages_per_shard)
+            ]
+            assert merge_page_shards(shards, normalize_titles) == expected, pages_per_shard
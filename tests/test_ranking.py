@@ -0,0 +1,25 @@
+import numpy as np
+
+from utils.ranking import top_k_indices
+
+
+def stable_top_k(scores, k):
+    return sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k]
+
+
+def test_top_k_matches_stable_sort_with_heavy_ties():
+    rng = np.random.default_rng(0)
+    for _ in range(2000):
+        n = int(rng.integers(1, 60))
+        # Few distinct values, so ties straddle the k-th place most of the time
+        scores = rng.integers(0, 4, n).astype(np.float32)
+        k = int(rng.integers(0, n + 2))
+        assert top_k_indices(scores, k).tolist() == stable_top_k(scores.tolist(), k)
+
+
+def test_top_k_edge_cases():
+    scores = np.array([0.5, 0.5, 0.5], dtype=np.float32)
+    assert top_k_indices(scores, 0).tolist() == []
+    assert top_k_indices(scores, 2).tolist() == [0, 1]
+    assert top_k_indices(scores, 10).tolist() == [0, 1, 2]
+    assert top_k_indices(np.empty(0, dtype=np.float32), 3).tolist() == []
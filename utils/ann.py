@@ -0,0 +1,393 @@
+"""
+Approximate nearest-neighbour search over section embeddings.
+
+Cosine similarity is computed as the inner product of L2-normalised vectors.
+Below exact_threshold sections the index does exact brute-force search;
+above it, a FAISS HNSW graph or IVF index answers queries without touching
+every section.
+
+The "int8" and "binary" index types keep only compact codes in memory (1 byte
+or 1 bit per dimension) and scan those, then rescore a small candidate set
+exactly against the float32 vectors. The float vectors are never held in
+RAM: they are memory-mapped from the index directory (or from an unlinked
+temporary file when the index is not saved) and only candidate rows are read.
+
+Measure recall@k against brute force, query latency and memory:
+
+    python -m utils.ann benchmark --sections 1000000 --index hnsw binary
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from utils.ranking import top_k_indices
+
+ANN_INDEX_TYPES = ("exact", "hnsw", "ivf", "int8", "binary")
+QUANTIZED_INDEX_TYPES = ("int8", "binary")
+
+INDEX_FILE = "index.faiss"
+VECTORS_FILE = "vectors.npy"
+CODES_FILE = "codes.npy"
+RANGES_FILE = "ranges.npy"
+META_FILE = "meta.json"
+
+# Bits set in each byte value, for Hamming distances over packed codes
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint16)
+# Rows per block when scanning quantized codes; small enough that the
+# float32 copy of an int8 block stays in cache
+_SCAN_ROWS = 4096
+
+
+def _faiss():
+    try:
+        import faiss
+    except ImportError as e:
+        raise ImportError("The hnsw and ivf section indexes need faiss: pip install faiss-cpu") from e
+    return faiss
+
+
+def normalize_rows(embeddings):
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.clip(norms, 1e-12, None)
+
+
+def _popcount(codes):
+    # numpy >= 2.0 has a vectorised popcount; older versions use a lookup table
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(codes)
+    return _POPCOUNT[codes]
+
+
+def quantize_int8(embeddings, ranges=None):
+    """
+    Scalar-quantize each dimension to int8 over its (min, max) range.
+
+    Returns the codes and the (2, dimension) ranges used, so queries can be
+    scored against the codes directly.
+    """
+    if ranges is None:
+        ranges = np.stack([embeddings.min(axis=0), embeddings.max(axis=0)])
+    low, high = ranges
+    step = np.clip(high - low, 1e-12, None) / 255
+    codes = np.clip(np.round((embeddings - low) / step) - 128, -128, 127).astype(np.int8)
+    return codes, ranges.astype(np.float32)
+
+
+def quantize_binary(embeddings):
+    """One bit per dimension (positive or not), packed eight to a byte."""
+    return np.packbits(embeddings > 0, axis=1)
+
+
+def _mapped_copy(vectors):
+    """Read-only memory map of vectors, backed by an unlinked temporary file."""
+    with tempfile.TemporaryFile() as f:
+        for start in range(0, len(vectors), 100000):
+            f.write(np.ascontiguousarray(vectors[start:start + 100000]).tobytes())
+        f.flush()
+        # The mapping keeps the file's pages alive after the handle is closed
+        return np.memmap(f, dtype=np.float32, mode="r", shape=vectors.shape)
+
+
+def embeddings_key(embeddings, options):
+    """Content hash of an embedding matrix and the index options built over it."""
+    digest = hashlib.sha256(np.ascontiguousarray(embeddings, dtype=np.float32).tobytes())
+    digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class SectionIndex:
+    """
+    Cosine-similarity index over section embeddings.
+
+    Args:
+        index_type (str): "exact", "hnsw" or "ivf"
+        exact_threshold (int): Fewer sections than this are searched exactly
+            whatever the index_type
+        hnsw_m (int): Graph neighbours per node for HNSW
+        ef_search (int): HNSW candidate list size at query time
+        ivf_lists (int, optional): IVF cells; defaults to 4 * sqrt(n)
+        nprobe (int): IVF cells visited per query
+        rescore_multiplier (int): int8/binary candidates rescored per result
+    """
+
+    def __init__(self, index_type="hnsw", exact_threshold=50000, hnsw_m=32,
+                 ef_search=64, ivf_lists=None, nprobe=16, rescore_multiplier=10):
+        if index_type not in ANN_INDEX_TYPES:
+            raise ValueError(f"Unknown ANN index type: {index_type}")
+        self.index_type = index_type
+        self.exact_threshold = exact_threshold
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.ivf_lists = ivf_lists
+        self.nprobe = nprobe
+        self.rescore_multiplier = rescore_multiplier
+        self.kind = "exact"
+        self.index = None
+        self.vectors = None
+        self.codes = None
+        self.ranges = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def options(self):
+        return {
+            "index_type": self.index_type, "exact_threshold": self.exact_threshold,
+            "hnsw_m": self.hnsw_m, "ef_search": self.ef_search,
+            "ivf_lists": self.ivf_lists, "nprobe": self.nprobe,
+            "rescore_multiplier": self.rescore_multiplier
+        }
+
+    def build(self, embeddings):
+        embeddings = normalize_rows(embeddings)
+        self.size, dimension = embeddings.shape
+        # The search actually used: "exact" below the threshold, else index_type
+        self.kind = "exact" if self.size < self.exact_threshold else self.index_type
+        if self.kind == "exact":
+            self.vectors = embeddings
+            return self
+        if self.kind in QUANTIZED_INDEX_TYPES:
+            if self.kind == "int8":
+                self.codes, self.ranges = quantize_int8(embeddings)
+            else:
+                self.codes = quantize_binary(embeddings)
+            # The float vectors are only read for rescoring, so keep them out of RAM
+            self.vectors = _mapped_copy(embeddings)
+            return self
+
+        faiss = _faiss()
+        if self.index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(dimension, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = max(2 * self.hnsw_m, 80)
+        else:
+            lists = self.ivf_lists or max(1, int(4 * np.sqrt(self.size)))
+            quantizer = faiss.IndexFlatIP(dimension)
+            index = faiss.IndexIVFFlat(quantizer, dimension, lists, faiss.METRIC_INNER_PRODUCT)
+            # k-means on a sample is enough to place the cells
+            sample = embeddings[np.random.default_rng(0).permutation(self.size)[:lists * 64]]
+            index.train(sample)
+        index.add(embeddings)
+        self.index = index
+        self._configure()
+        return self
+
+    def _configure(self):
+        if self.index_type == "hnsw":
+            self.index.hnsw.efSearch = self.ef_search
+        elif self.index_type == "ivf":
+            self.index.nprobe = self.nprobe
+
+    def search(self, queries, k):
+        """
+        Best k sections per query.
+
+        Returns (scores, ids), each shaped (queries, k) and best first. Rows
+        with fewer than k hits are padded with id -1.
+        """
+        queries = normalize_rows(np.atleast_2d(queries))
+        k = min(k, self.size)
+        if self.index is not None:
+            return self.index.search(queries, k)
+        if self.kind in QUANTIZED_INDEX_TYPES:
+            return self._search_quantized(queries, k)
+
+        similarities = queries @ self.vectors.T
+        ids = np.stack([top_k_indices(row, k) for row in similarities])
+        return np.take_along_axis(similarities, ids, axis=1), ids
+
+    def _search_quantized(self, queries, k):
+        candidate_count = min(self.size, k * self.rescore_multiplier)
+        all_scores = np.empty((len(queries), k), dtype=np.float32)
+        all_ids = np.empty((len(queries), k), dtype=np.int64)
+        for row, query in enumerate(queries):
+            # Sorted, so rows are read from memory-mapped vectors in file order
+            candidates = np.sort(top_k_indices(self._approximate_scores(query), candidate_count))
+            exact = np.asarray(self.vectors[candidates], dtype=np.float32) @ query
+            best = top_k_indices(exact, k)
+            all_scores[row], all_ids[row] = exact[best], candidates[best]
+        return all_scores, all_ids
+
+    def _approximate_scores(self, query):
+        """Scores that rank sections like cosine similarity, from the codes alone."""
+        scores = np.empty(self.size, dtype=np.float32)
+        if self.kind == "int8":
+            # Dot products with the codes differ from the dequantized ones
+            # only by a per-query constant, which does not change the ranking
+            weights = query * (self.ranges[1] - self.ranges[0]) / 255
+            for start in range(0, self.size, _SCAN_ROWS):
+                block = self.codes[start:start + _SCAN_ROWS]
+                scores[start:start + len(block)] = block.astype(np.float32) @ weights
+        else:
+            packed_query = quantize_binary(query[None, :])[0]
+            for start in range(0, self.size, _SCAN_ROWS):
+                block = self.codes[start:start + _SCAN_ROWS]
+                distances = _popcount(np.bitwise_xor(block, packed_query)).sum(axis=1, dtype=np.int32)
+                scores[start:start + len(block)] = -distances.astype(np.float32)
+        return scores
+
+    def memory_bytes(self):
+        """
+        Bytes held in RAM to answer queries. Memory-mapped vectors are left
+        out (see mapped_bytes); vectors loaded into RAM are counted.
+        """
+        if self.index is not None:
+            return len(_faiss().serialize_index(self.index))
+        total = 0
+        for array in (self.vectors, self.codes, self.ranges):
+            if array is not None and not isinstance(array, np.memmap):
+                total += array.nbytes
+        return total
+
+    def mapped_bytes(self):
+        """Bytes of float vectors memory-mapped from disk; only candidate rows are paged in."""
+        return self.vectors.nbytes if isinstance(self.vectors, np.memmap) else 0
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        if self.index is not None:
+            _faiss().write_index(self.index, os.path.join(directory, INDEX_FILE))
+        else:
+            np.save(os.path.join(directory, VECTORS_FILE), self.vectors)
+        if self.codes is not None:
+            np.save(os.path.join(directory, CODES_FILE), self.codes)
+        if self.ranges is not None:
+            np.save(os.path.join(directory, RANGES_FILE), self.ranges)
+        with open(os.path.join(directory, META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"options": self.options, "kind": self.kind, "size": self.size}, f, indent=2)
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        section_index = cls(**meta["options"])
+        section_index.size = meta["size"]
+        section_index.kind = meta["kind"]
+        if meta["kind"] == "exact":
+            section_index.vectors = np.load(os.path.join(directory, VECTORS_FILE))
+        elif meta["kind"] in QUANTIZED_INDEX_TYPES:
+            # Only the codes are loaded; rescoring reads candidate rows from disk
+            section_index.vectors = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode="r")
+            section_index.codes = np.load(os.path.join(directory, CODES_FILE))
+            if os.path.exists(os.path.join(directory, RANGES_FILE)):
+                section_index.ranges = np.load(os.path.join(directory, RANGES_FILE))
+        else:
+            section_index.index = _faiss().read_index(os.path.join(directory, INDEX_FILE))
+            section_index._configure()
+        return section_index
+
+
+def load_or_build(embeddings, index_dir=None, **options):
+    """
+    SectionIndex over embeddings, reloaded from index_dir when the same
+    embeddings were indexed with the same options before.
+    """
+    section_index = SectionIndex(**options)
+    if not index_dir:
+        return section_index.build(embeddings)
+
+    directory = os.path.join(index_dir, embeddings_key(embeddings, section_index.options))
+    if not os.path.exists(os.path.join(directory, META_FILE)):
+        section_index.build(embeddings)
+        section_index.save(directory)
+    # Reloaded even right after saving, so quantized indexes map their
+    # vectors from the saved file instead of a temporary copy
+    return SectionIndex.load(directory)
+
+
+def recall_at_k(section_index, embeddings, queries, k):
+    """Share of the exact top-k neighbours that section_index also returns."""
+    exact = SectionIndex("exact").build(embeddings)
+    _, expected = exact.search(queries, k)
+    _, found = section_index.search(queries, k)
+    hits = sum(len(set(row_expected) & set(row_found)) for row_expected, row_found in zip(expected, found))
+    return hits / expected.size
+
+
+def _synthetic_embeddings(count, dimension, clusters, rng, latent_dimension=32):
+    """
+    Clustered unit vectors with a low intrinsic dimension. Like real sentence
+    embeddings, and unlike isotropic noise, they have meaningful neighbours.
+    """
+    centres = rng.standard_normal((clusters, latent_dimension), dtype=np.float32)
+    projection = rng.standard_normal((latent_dimension, dimension), dtype=np.float32)
+    embeddings = np.empty((count, dimension), dtype=np.float32)
+    for start in range(0, count, 100000):
+        stop = min(start + 100000, count)
+        latent = centres[rng.integers(0, clusters, stop - start)]
+        latent += 0.5 * rng.standard_normal((stop - start, latent_dimension), dtype=np.float32)
+        embeddings[start:stop] = latent @ projection
+        embeddings[start:stop] += 0.5 * rng.standard_normal((stop - start, dimension), dtype=np.float32)
+    return normalize_rows(embeddings)
+
+
+def benchmark(index_type, sections, dimension=384, queries=200, k=10, **options):
+    rng = np.random.default_rng(0)
+    embeddings = _synthetic_embeddings(sections + queries, dimension, max(16, sections // 2000), rng)
+    embeddings, query_embeddings = embeddings[:sections], embeddings[sections:]
+
+    start = time.perf_counter()
+    section_index = SectionIndex(index_type, exact_threshold=0, **options).build(embeddings)
+    build_seconds = time.perf_counter() - start
+
+    latencies = []
+    for query in query_embeddings:
+        start = time.perf_counter()
+        section_index.search(query, k)
+        latencies.append(time.perf_counter() - start)
+    latencies_ms = np.asarray(latencies) * 1000
+
+    return {
+        "index": index_type, "sections": sections, "queries": queries, "k": k,
+        "build_seconds": build_seconds,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "mb_per_million": section_index.memory_bytes() / sections * 1e6 / (1 << 20),
+        "mapped_mb_per_million": section_index.mapped_bytes() / sections * 1e6 / (1 << 20),
+        "recall": recall_at_k(section_index, embeddings, query_embeddings, k)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark section ANN indexes against brute force")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bench = commands.add_parser(
+        "benchmark", help="Report recall@k, per-query latency and memory on synthetic embeddings"
+    )
+    bench.add_argument("--index", choices=ANN_INDEX_TYPES, nargs="+", default=list(ANN_INDEX_TYPES))
+    bench.add_argument("--sections", type=int, default=100000)
+    bench.add_argument("--dimension", type=int, default=384)
+    bench.add_argument("--queries", type=int, default=200)
+    bench.add_argument("--k", type=int, default=10)
+    bench.add_argument("--ef-search", type=int, default=64)
+    bench.add_argument("--nprobe", type=int, default=16)
+    bench.add_argument("--rescore-multiplier", type=int, default=10)
+
+    args = parser.parse_args(argv)
+    for index_type in args.index:
+        report = benchmark(
+            index_type, args.sections, dimension=args.dimension, queries=args.queries, k=args.k,
+            ef_search=args.ef_search, nprobe=args.nprobe, rescore_multiplier=args.rescore_multiplier
+        )
+        mapped = ""
+        if report["mapped_mb_per_million"]:
+            mapped = f" (+{report['mapped_mb_per_million']:.0f} MB memory-mapped)"
+        print(f"{report['index']}: {report['sections']} sections, build {report['build_seconds']:.1f}s, "
+              f"p50 {report['p50_ms']:.2f} ms, p99 {report['p99_ms']:.2f} ms, "
+              f"{report['mb_per_million']:.0f} MB in RAM per million sections"
+              f"{mapped}, "
+              f"recall@{report['k']} {report['recall']:.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
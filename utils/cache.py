@@ -0,0 +1,279 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-256 of a file's content, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    Size-bounded directory of JSON entries that several processes can share.
+
+    Entries are written to a temporary file and renamed into place, so readers
+    never see a partial entry. Reads refresh an entry's mtime and eviction
+    removes the least recently used entries once the directory grows past
+    max_bytes. Entries that disappear underneath us (another process evicted
+    them) are treated as misses.
+
+    The directory is only walked when a running size estimate passes
+    max_bytes, and every RESCAN_EVERY puts to pick up other processes' writes.
+    """
+
+    TEMP_PREFIX = ".tmp-"
+    RESCAN_EVERY = 1000
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        # Bytes on disk as of the last scan plus this process's writes since;
+        # None until the first put scans the directory
+        self._size = None
+        self._puts_since_scan = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            # Evicted by another process after we read it; the value is still good
+            pass
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            replaced_size = os.path.getsize(path)
+        except OSError:
+            replaced_size = 0
+        fd, tmp_path = tempfile.mkstemp(prefix=self.TEMP_PREFIX, dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        self._puts_since_scan += 1
+        if self._size is None or self._puts_since_scan >= self.RESCAN_EVERY:
+            self.evict()
+            return
+        try:
+            self._size += os.path.getsize(path) - replaced_size
+        except OSError:
+            # Already evicted by another process
+            self._size -= replaced_size
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Walks the directory and removes least recently used entries past max_bytes."""
+        entries = []
+        total = 0
+        stale_before = time.time() - 3600
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if name.startswith(self.TEMP_PREFIX):
+                    # Left behind by a writer that died mid-write
+                    if stat.st_mtime < stale_before:
+                        self._remove(path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total > self.max_bytes:
+            # Evict down to 90% so the next few puts stay under max_bytes
+            # without triggering another scan
+            target = self.max_bytes * 0.9
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                self._remove(path)
+                total -= size
+
+        self._size = total
+        self._puts_since_scan = 0
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class ExtractionCache(DiskCache):
+    """
+    Content-addressed cache of DocumentExtractor output.
+
+    Keys combine the PDF's content hash with the extractor fingerprint, so
+    byte-identical files hit regardless of their name and any change to the
+    extraction heuristics invalidates old entries.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, fingerprint=""):
+        super().__init__(directory, max_bytes)
+        self.fingerprint = fingerprint
+
+    def key(self, path):
+        content_hash = file_digest(path)
+        return hashlib.sha256(f"{self.fingerprint}:{content_hash}".encode("utf-8")).hexdigest()
+
+    def load(self, key, path):
+        sections = self.get(key)
+        if sections is None:
+            return None
+        # Same content may be cached under a different file name
+        document = os.path.basename(path)
+        for section in sections:
+            section["document"] = document
+        return sections
+
+    def store(self, key, sections):
+        self.put(key, sections)
+
+
+class SummaryCache(DiskCache):
+    """
+    Cache of generated summaries.
+
+    Keys cover everything that determines a summary: the model id, the
+    generation kwargs, the persona and job, and the hash of the exact model
+    input, so changing any of them misses instead of returning a stale summary.
+    """
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024):
+        super().__init__(directory, max_bytes)
+
+    @staticmethod
+    def key(model_name, generation_kwargs, persona, job_description, model_input):
+        content_hash = hashlib.sha256(model_input.encode("utf-8")).hexdigest()
+        parts = [model_name, sorted(generation_kwargs.items()), persona, job_description, content_hash]
+        return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+    def load(self, key):
+        entry = self.get(key)
+        return entry["summary"] if entry else None
+
+    def store(self, key, summary):
+        self.put(key, {"summary": summary})
+
+
+def normalize_text(text):
+    """Collapses whitespace runs; the form texts are embedded and cached in."""
+    return " ".join(text.split())
+
+
+class EmbeddingCache:
+    """
+    SQLite-backed store of text embeddings, keyed by model name and the hash
+    of the normalized text.
+
+    The database can be shared by several processes (WAL mode, busy timeout).
+    Hits refresh an entry's last-used time and the least recently used
+    entries are evicted once the stored vectors exceed max_bytes.
+    """
+
+    def __init__(self, path, max_bytes=1024 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.conn.commit()
+
+    @staticmethod
+    def key(model_name, text):
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, model_name, texts):
+        """Returns {text: float32 vector} for the texts that are cached."""
+        keys = {self.key(model_name, text): text for text in texts}
+        found = {}
+        key_list = list(keys)
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(key_list), 500):
+            chunk = key_list[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+            ).fetchall()
+            for key, vector in rows:
+                found[keys[key]] = np.frombuffer(vector, dtype=np.float32)
+            if rows:
+                now = time.time()
+                self.conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key, _ in rows]
+                )
+        self.conn.commit()
+        return found
+
+    def put_many(self, model_name, items):
+        """Stores (text, vector) pairs, then evicts down to max_bytes."""
+        now = time.time()
+        rows = [
+            (self.key(model_name, text), np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for text, vector in items
+        ]
+        if not rows:
+            return
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+        )
+        self.conn.commit()
+        self.evict(len(rows[0][1]))
+
+    def evict(self, vector_bytes):
+        max_entries = max(1, self.max_bytes // vector_bytes)
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count <= max_entries:
+            return
+        # Evict down to 90% so we don't evict on every subsequent put
+        excess = count - int(max_entries * 0.9)
+        self.conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
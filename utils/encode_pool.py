@@ -0,0 +1,96 @@
+"""
+Multi-process sentence encoding.
+
+PyTorch intra-op threading stops scaling after a few cores for MiniLM-sized
+models, so large encoding jobs are split across worker processes instead.
+Each worker loads the encoder once, is pinned to a fixed number of threads
+and stays alive until the pool is closed.
+"""
+import multiprocessing
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+
+from utils.encoders import load_encoder
+
+# Encoder loaded by _init_worker, one per worker process
+_worker_model = None
+
+
+def _init_worker(backend, model_name, onnx_dir, max_seq_length, threads):
+    global _worker_model
+    torch.set_num_threads(threads)
+    _worker_model = load_encoder(backend, model_name, onnx_dir, num_threads=threads)
+    if max_seq_length:
+        _worker_model.max_seq_length = int(max_seq_length)
+
+
+def _encode_chunk(texts, batch_size):
+    return _worker_model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+
+
+class EncodePool:
+    """
+    Persistent pool of encoder processes.
+
+    Args:
+        workers (int): Worker processes
+        threads_per_worker (int, optional): Threads per worker; defaults to
+            an even split of the machine's cores
+        backend, model_name, onnx_dir, max_seq_length: as for SectionScorer
+    """
+
+    def __init__(self, workers, threads_per_worker=None, backend="torch", model_name="all-MiniLM-L6-v2",
+                 onnx_dir=None, max_seq_length=None):
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        # spawn: forked workers would inherit the parent's torch thread pool state
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(backend, model_name, onnx_dir, max_seq_length, self.threads_per_worker)
+        )
+        # Pools dropped without close() still stop their workers
+        self._finalizer = weakref.finalize(self, self.executor.shutdown, wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """Stops the workers. Safe to call twice."""
+        if self.executor is not None:
+            self._finalizer()
+            self.executor = None
+
+    def encode(self, texts, batch_size=32):
+        """
+        Embeddings of texts as a float32 array, in input order.
+
+        Texts are length-sorted before being cut into chunks, so every worker
+        pads its batches only to similar lengths; about four chunks per
+        worker keep the workers evenly loaded.
+        """
+        if self.executor is None:
+            raise RuntimeError("EncodePool is closed")
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        chunk_size = max(batch_size, -(-len(texts) // (self.workers * 4)))
+        chunk_size = -(-chunk_size // batch_size) * batch_size
+        chunks = [order[start:start + chunk_size] for start in range(0, len(texts), chunk_size)]
+
+        futures = [
+            self.executor.submit(_encode_chunk, [texts[i] for i in chunk], batch_size)
+            for chunk in chunks
+        ]
+        results = [future.result() for future in futures]
+
+        embeddings = np.empty((len(texts), results[0].shape[1]), dtype=np.float32)
+        for chunk, result in zip(chunks, results):
+            embeddings[chunk] = result
+        return embeddings
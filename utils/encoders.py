@@ -0,0 +1,253 @@
+"""
+Pluggable sentence encoders for SectionScorer.
+
+- "torch": the sentence-transformers model in PyTorch (default)
+- "onnx": the same model exported to ONNX and run with ONNX Runtime
+- "onnx-int8": the ONNX export with dynamically int8-quantized weights
+
+Every backend exposes the subset of SentenceTransformer the scorer uses:
+encode(texts, batch_size, convert_to_tensor, convert_to_numpy), device and
+max_seq_length.
+
+Export once, then check drift against PyTorch:
+
+    python -m utils.encoders export --model all-MiniLM-L6-v2 --output models/all-MiniLM-L6-v2-onnx
+    python -m utils.encoders parity --model all-MiniLM-L6-v2 --onnx-dir models/all-MiniLM-L6-v2-onnx
+"""
+import argparse
+import glob
+import inspect
+import json
+import os
+import sys
+
+import numpy as np
+import torch
+
+ENCODER_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INT8_MODEL_FILE = "model.int8.onnx"
+ENCODER_CONFIG_FILE = "encoder_config.json"
+
+
+def load_encoder(backend="torch", model_name="all-MiniLM-L6-v2", onnx_dir=None, num_threads=None):
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend: {backend}")
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name)
+    if not onnx_dir:
+        raise ValueError(f"The {backend} encoder backend needs onnx_dir (run `python -m utils.encoders export` first)")
+    return OnnxEncoder(onnx_dir, quantized=backend == "onnx-int8", num_threads=num_threads)
+
+
+class OnnxEncoder:
+    """Sentence encoder running an exported transformer with ONNX Runtime."""
+
+    def __init__(self, onnx_dir, quantized=False, num_threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("The ONNX encoder backends need onnxruntime: pip install onnxruntime") from e
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(onnx_dir, ENCODER_CONFIG_FILE), "r", encoding="utf-8") as f:
+            config = json.load(f)
+        self.pooling = config["pooling"]
+        self.normalize = config["normalize"]
+        self.dimension = config["dimension"]
+        self.max_seq_length = config["max_seq_length"]
+        self.device = torch.device("cpu")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        model_file = ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        self.session = ort.InferenceSession(
+            os.path.join(onnx_dir, model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(onnx_dir)
+
+    def encode(self, sentences, batch_size=32, convert_to_tensor=False, convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        embeddings = np.zeros((len(sentences), self.dimension), dtype=np.float32)
+        # Longest first, so each batch is padded only to its own longest text
+        order = np.argsort([-len(sentence) for sentence in sentences], kind="stable")
+        for start in range(0, len(sentences), batch_size):
+            batch_idx = order[start:start + batch_size]
+            features = self.tokenizer(
+                [sentences[i] for i in batch_idx], padding=True, truncation=True,
+                max_length=self.max_seq_length, return_tensors="np"
+            )
+            feeds = {name: features[name].astype(np.int64) for name in self.input_names}
+            token_embeddings = self.session.run(None, feeds)[0]
+            embeddings[batch_idx] = self._pool(token_embeddings, features["attention_mask"])
+
+        if single:
+            embeddings = embeddings[0]
+        if convert_to_tensor:
+            return torch.from_numpy(embeddings)
+        return embeddings
+
+    def _pool(self, token_embeddings, attention_mask):
+        if self.pooling == "cls":
+            pooled = token_embeddings[:, 0]
+        else:
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled
+
+
+class _TokenEmbeddings(torch.nn.Module):
+    """Exposes only last_hidden_state so the ONNX graph has a single output."""
+
+    def __init__(self, transformer):
+        super().__init__()
+        self.transformer = transformer
+
+    def forward(self, input_ids, attention_mask, token_type_ids=None):
+        return self.transformer(
+            input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+        )[0]
+
+
+def export_onnx(model_name, output_dir, quantize=True, opset=14):
+    """
+    Export a sentence-transformers model to ONNX in output_dir, plus an
+    int8 dynamically quantized copy when quantize is set.
+    """
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+    pooling = next((module for module in model if isinstance(module, Pooling)), None)
+    pooling_mode = _pooling_mode(pooling.get_config_dict()) if pooling is not None else "mean"
+    if pooling_mode not in ("mean", "cls"):
+        raise ValueError("Only mean and CLS pooling can be exported")
+
+    os.makedirs(output_dir, exist_ok=True)
+    dummy = tokenizer(["Persona-driven document intelligence"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["token_embeddings"] = {0: "batch", 1: "sequence"}
+
+    export_kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # Newer torch defaults to the dynamo exporter; keep the TorchScript one
+        export_kwargs["dynamo"] = False
+
+    fp32_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            _TokenEmbeddings(transformer),
+            tuple(dummy[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            **export_kwargs
+        )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, os.path.join(output_dir, ONNX_INT8_MODEL_FILE), weight_type=QuantType.QInt8)
+
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, ENCODER_CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "model_name": model_name,
+            "pooling": pooling_mode,
+            "normalize": any(isinstance(module, Normalize) for module in model),
+            "dimension": model.get_sentence_embedding_dimension(),
+            "max_seq_length": model.max_seq_length
+        }, f, indent=2)
+
+
+def _pooling_mode(config):
+    # sentence-transformers 2.x stores one boolean flag per pooling mode
+    if "pooling_mode" in config:
+        return config["pooling_mode"]
+    if config.get("pooling_mode_cls_token"):
+        return "cls"
+    if config.get("pooling_mode_mean_tokens"):
+        return "mean"
+    return None
+
+
+def parity_check(model_name, onnx_dir, texts, quantized=False, batch_size=32):
+    """
+    Cosine drift of an ONNX backend against the PyTorch embeddings.
+
+    Returns mean and max of (1 - cosine similarity) over texts.
+    """
+    reference = load_encoder("torch", model_name).encode(texts, batch_size=batch_size, convert_to_numpy=True)
+    candidate = OnnxEncoder(onnx_dir, quantized=quantized).encode(texts, batch_size=batch_size)
+    cosine = (reference * candidate).sum(axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    )
+    drift = 1.0 - cosine
+    return {"texts": len(texts), "mean_drift": float(drift.mean()), "max_drift": float(drift.max())}
+
+
+def _sample_texts(input_dir, limit):
+    """Section texts from the PDFs in input_dir, as the scorer would embed them."""
+    from utils.extractor import extract_document
+
+    texts = []
+    for pdf_path in sorted(glob.glob(os.path.join(input_dir, "*.pdf"))):
+        for section in extract_document(pdf_path):
+            texts.append(f"{section['section_title']} {section['text']}")
+            if len(texts) >= limit:
+                return texts
+    return texts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export and check ONNX section encoders")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Export the encoder to ONNX (fp32 and int8)")
+    export.add_argument("--model", default="all-MiniLM-L6-v2")
+    export.add_argument("--output", required=True)
+    export.add_argument("--no-quantize", action="store_true")
+    export.add_argument("--opset", type=int, default=14)
+
+    parity = commands.add_parser("parity", help="Report cosine drift against the PyTorch encoder")
+    parity.add_argument("--model", default="all-MiniLM-L6-v2")
+    parity.add_argument("--onnx-dir", required=True)
+    parity.add_argument("--input", default="input", help="Directory of PDFs to sample texts from")
+    parity.add_argument("--limit", type=int, default=256)
+
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        export_onnx(args.model, args.output, quantize=not args.no_quantize, opset=args.opset)
+        print(f"Exported {args.model} to {args.output}")
+        return 0
+
+    texts = _sample_texts(args.input, args.limit)
+    if not texts:
+        print(f"No sections found in {args.input}")
+        return 1
+    variants = [("onnx", False)]
+    if os.path.exists(os.path.join(args.onnx_dir, ONNX_INT8_MODEL_FILE)):
+        variants.append(("onnx-int8", True))
+    for backend, quantized in variants:
+        report = parity_check(args.model, args.onnx_dir, texts, quantized=quantized)
+        print(f"{backend}: {report['texts']} texts, mean drift {report['mean_drift']:.6f}, "
+              f"max drift {report['max_drift']:.6f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,51 +1,328 @@
 import os
+import sys
+import itertools
+import hashlib
+import inspect
+from collections import namedtuple
 import fitz  # PyMuPDF
-from langdetect import detect
+import numpy as np
 import re
 
+from utils.language import Section
+
+# Bump when extraction output changes in a way the source fingerprint can't see
+# (e.g. a PyMuPDF upgrade that changes text decoding).
+EXTRACTOR_VERSION = "1"
+
+HEADING_DETECTORS = ("text", "font")
+
+# "rich" decodes the full layout dict for every page; "fast" reads plain text
+# and only decodes the layout for pages where no heading was found.
+EXTRACTION_MODES = ("rich", "fast")
+
+# Only text is used, so never ask PyMuPDF to decode image blocks
+DICT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+TEXT_FLAGS = fitz.TEXTFLAGS_TEXT & ~fitz.TEXT_PRESERVE_IMAGES
+
+# Span flag bit PyMuPDF sets for bold fonts
+SPAN_BOLD = 16
+
+# Font statistics are estimated from at most this many evenly spaced pages,
+# so every page-range shard of a document sees the same statistics.
+FONT_SAMPLE_PAGES = 32
+
+# Lines at least this much larger than the body font are headings
+HEADING_SIZE_RATIO = 1.15
+
+FontStatistics = namedtuple("FontStatistics", ["body_size"])
+
+# Options that don't change extraction output, so they stay out of cache keys
+OUTPUT_NEUTRAL_OPTIONS = ("max_document_mb",)
+
+# Trailing punctuation ignored when normalize_titles is on ("Overview:" == "overview")
+_TRAILING_PUNCTUATION = re.compile(r"[\s.,:;!?\-\u2013\u2014]+$")
+
+
+class SectionTitleIndex:
+    """
+    Constant-time lookup of section titles already emitted for a document.
+
+    add() returns True only for the first occurrence of a title. With
+    normalize=True, titles that differ only in case, whitespace or trailing
+    punctuation count as the same title.
+    """
+
+    def __init__(self, normalize=False):
+        self.normalize = normalize
+        self._seen = set()
+
+    def key(self, title):
+        if not self.normalize:
+            return title
+        collapsed = " ".join(title.split())
+        return _TRAILING_PUNCTUATION.sub("", collapsed).casefold()
+
+    def add(self, title):
+        key = self.key(title)
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        return True
+
+    def __contains__(self, title):
+        return self.key(title) in self._seen
+
+    def __len__(self):
+        return len(self._seen)
+
+
+class PageLines:
+    """
+    Columnar model of one page's text lines.
+
+    Line text lives in a single buffer, joined by single spaces, with per-line
+    attributes held in NumPy arrays indexed by line number. Joining a run of
+    consecutive lines is one slice of the buffer instead of a " ".join.
+    """
+
+    __slots__ = ("text", "starts", "ends", "stripped_lengths", "sizes", "flags", "y", "block_lines")
+
+    def __init__(self, lines, sizes=None, flags=None, y=None, block_lines=None):
+        count = len(lines)
+        self.text = " ".join(lines)
+        lengths = np.fromiter(map(len, lines), dtype=np.int64, count=count)
+        self.ends = np.cumsum(lengths + 1) - 1
+        self.starts = self.ends - lengths
+        self.stripped_lengths = np.fromiter((len(line.strip()) for line in lines), dtype=np.int64, count=count)
+        # Largest span size, AND of span flags (bold only if every span is), top y, lines in block
+        self.sizes = np.zeros(count) if sizes is None else np.asarray(sizes, dtype=np.float64)
+        self.flags = np.zeros(count, dtype=np.int64) if flags is None else np.asarray(flags, dtype=np.int64)
+        self.y = np.zeros(count) if y is None else np.asarray(y, dtype=np.float64)
+        self.block_lines = np.zeros(count, dtype=np.int64) if block_lines is None else np.asarray(block_lines, dtype=np.int64)
+
+    @classmethod
+    def from_blocks(cls, blocks):
+        """Builds the page from PyMuPDF's get_text("dict") blocks."""
+        lines, sizes, flags, y, block_lines = [], [], [], [], []
+        for block in blocks:
+            lines_in_block = block.get("lines", [])
+            for line in lines_in_block:
+                spans = line.get("spans", [])
+                line_text = " ".join([span["text"].strip() for span in spans])
+                if not line_text:
+                    continue
+                text_spans = [span for span in spans if span["text"].strip()]
+                line_flags = -1 if text_spans else 0
+                for span in text_spans:
+                    line_flags &= span["flags"]
+                lines.append(line_text)
+                sizes.append(max([span["size"] for span in text_spans], default=0.0))
+                flags.append(line_flags)
+                y.append(line["bbox"][1] if "bbox" in line else 0.0)
+                block_lines.append(len(lines_in_block))
+        return cls(lines, sizes, flags, y, block_lines)
+
+    @classmethod
+    def from_text(cls, text):
+        """Builds the page from PyMuPDF's plain-text output; font columns stay zero."""
+        return cls([line.strip() for line in text.splitlines() if line.strip()])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def line(self, i):
+        return self.text[self.starts[i]:self.ends[i]]
+
+    def join(self, start, stop):
+        """Same as " ".join(lines[start:stop])."""
+        if start >= stop:
+            return ""
+        return self.text[self.starts[start]:self.ends[stop - 1]]
+
 
 class DocumentExtractor:
-    def __init__(self, path):
+    """
+    Extracts heading-delimited sections from one PDF.
+
+    Use as a context manager (or call close()) so the document handle and
+    MuPDF's page caches are released as soon as extraction finishes.
+    Documents larger than max_document_mb are processed page-at-a-time:
+    nothing decoded is kept between pages and MuPDF's store is emptied after
+    every page.
+    """
+
+    def __init__(self, path, normalize_titles=False, heading_detector="text", extraction_mode="rich",
+                 max_document_mb=256, max_section_chars=500, font_stats=None):
+        if heading_detector not in HEADING_DETECTORS:
+            raise ValueError(f"Unknown heading detector: {heading_detector}")
+        if extraction_mode not in EXTRACTION_MODES:
+            raise ValueError(f"Unknown extraction mode: {extraction_mode}")
         self.path = path
         self.doc = fitz.open(path)
+        self.normalize_titles = normalize_titles
+        self.heading_detector = heading_detector
+        # The font detector needs span metadata, so it always uses the rich layout
+        self.extraction_mode = extraction_mode
+        # Section text kept for scoring and summarizing; 0 keeps the whole section
+        self.max_section_chars = max_section_chars
+        self.low_memory = bool(max_document_mb) and os.path.getsize(path) > max_document_mb * 1024 * 1024
+        # Statistics computed once for the whole document (see
+        # document_font_statistics), so page-range shards do not resample
+        self._font_stats = FontStatistics(*font_stats) if font_stats is not None else None
+        # Page layouts decoded while sampling font statistics, reused once by iter_pages
+        self._page_blocks_cache = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """Closes the document and releases cached page data. Safe to call twice."""
+        self._page_blocks_cache.clear()
+        if not self.doc.is_closed:
+            self.doc.close()
+            release_page_store()
+
+    def page_count(self):
+        return len(self.doc)
 
     def extract_sections(self):
-        sections = []
-        for page_num in range(len(self.doc)):
-            page = self.doc[page_num]
-            blocks = page.get_text("dict")["blocks"]
-            lines = []
-            
-            # Collect all lines with their positions
-            for block in blocks:
-                for line in block.get("lines", []):
-                    line_text = " ".join([span["text"].strip() for span in line.get("spans", [])])
-                    if line_text:
-                        lines.append(line_text)
+        return list(self.iter_sections())
+
+    def iter_sections(self):
+        """
+        Yields deduplicated sections as each page is parsed.
 
-            # Heuristic: Lines that look like section titles (capitalized or numbered)
-            heading_indices = []
-            for i, line in enumerate(lines):
-                if self._is_heading(line):
-                    heading_indices.append(i)
+        Produces the same sections, in the same order, as extract_sections.
+        """
+        return deduplicate_sections(self.iter_pages(), self.normalize_titles)
+
+    def extract_pages(self, start=0, stop=None):
+        """
+        Collects heading candidates for pages [start, stop) in page order.
+
+        Candidates are not deduplicated across pages; merge_page_shards does
+        that once the shards are put back in page order.
+        """
+        return list(self.iter_pages(start, stop))
+
+    def iter_pages(self, start=0, stop=None):
+        """Yields heading candidates for pages [start, stop), page by page."""
+        stop = len(self.doc) if stop is None else min(stop, len(self.doc))
+        for page_num in range(start, stop):
+            page_lines, heading_indices = self._page_headings(page_num)
 
             # Extract section info between heading indices
             for idx, start_idx in enumerate(heading_indices):
-                end_idx = heading_indices[idx + 1] if idx + 1 < len(heading_indices) else len(lines)
-                section_title = lines[start_idx].strip()
-                section_text = " ".join(lines[start_idx + 1:end_idx]).strip()
-
-                if section_title not in [s["section_title"] for s in sections]:  # deduplicate
-                    section = {
-                        "document": os.path.basename(self.path),
-                        "page_number": page_num + 1,
-                        "section_title": section_title,
-                        "text": section_text[:500],  # limit text length for scoring
-                        "language": detect(section_title) if len(section_title) > 3 else "unknown"
-                    }
-                    sections.append(section)
-
-        return sections
+                end_idx = heading_indices[idx + 1] if idx + 1 < len(heading_indices) else len(page_lines)
+                section_title = page_lines.line(start_idx).strip()
+                section_text = page_lines.join(start_idx + 1, end_idx).strip()
+                if self.max_section_chars:
+                    section_text = section_text[:self.max_section_chars]
+
+                yield Section({
+                    "document": os.path.basename(self.path),
+                    "page_number": page_num + 1,
+                    "section_title": section_title,
+                    "text": section_text,
+                })
+
+            if self.low_memory:
+                release_page_store()
+
+    def _page_headings(self, page_num):
+        """Returns the page's PageLines and the indices of the lines that are headings."""
+        if self.extraction_mode == "fast" and self.heading_detector == "text":
+            page_lines = PageLines.from_text(self.doc[page_num].get_text("text", flags=TEXT_FLAGS))
+            heading_indices = self._text_heading_indices(page_lines)
+            if heading_indices:
+                return page_lines, heading_indices
+            # Nothing found in plain text: retry the page with the full layout
+
+        if self.heading_detector == "font":
+            # Sample first: sampling may decode this page and keep it for us
+            self.font_statistics()
+            page_lines = PageLines.from_blocks(self._page_blocks(page_num))
+            return page_lines, self._font_heading_indices(page_lines)
+        page_lines = PageLines.from_blocks(self._page_blocks(page_num))
+        return page_lines, self._text_heading_indices(page_lines)
+
+    def _text_heading_indices(self, page_lines):
+        # Heuristic: Lines that look like section titles (capitalized or numbered)
+        heading_indices = []
+        for i in range(len(page_lines)):
+            if self._is_heading(page_lines.line(i)):
+                heading_indices.append(i)
+        return heading_indices
+
+    def font_statistics(self):
+        """
+        Font statistics for the whole document, computed once.
+
+        The body font size is the size carrying the most characters across a
+        deterministic sample of pages.
+        """
+        if self._font_stats is not None:
+            return self._font_stats
+
+        page_count = len(self.doc)
+        sample = np.unique(np.linspace(0, page_count - 1, min(page_count, FONT_SAMPLE_PAGES)).round().astype(int))
+        # When the sample is the whole document, keep the decoded pages for iter_pages
+        keep_pages = len(sample) == page_count and not self.low_memory
+
+        sizes, chars = [], []
+        for page_num in sample.tolist():
+            blocks = self._decode_blocks(page_num)
+            if keep_pages:
+                self._page_blocks_cache[page_num] = blocks
+            for block in blocks:
+                for line in block.get("lines", []):
+                    for span in line.get("spans", []):
+                        sizes.append(span["size"])
+                        chars.append(len(span["text"].strip()))
+
+        chars = np.asarray(chars, dtype=np.float64)
+        if not chars.sum():
+            self._font_stats = FontStatistics(body_size=0.0)
+            return self._font_stats
+
+        # Bucket sizes to half points, then take the bucket holding the most text
+        buckets, inverse = np.unique(np.round(np.asarray(sizes, dtype=np.float64) * 2) / 2, return_inverse=True)
+        weight = np.bincount(inverse, weights=chars)
+        self._font_stats = FontStatistics(body_size=float(buckets[np.argmax(weight)]))
+        return self._font_stats
+
+    def _page_blocks(self, page_num):
+        blocks = self._page_blocks_cache.pop(page_num, None)
+        if blocks is None:
+            blocks = self._decode_blocks(page_num)
+        return blocks
+
+    def _decode_blocks(self, page_num):
+        return self.doc[page_num].get_text("dict", flags=DICT_FLAGS)["blocks"]
+
+    def _font_heading_indices(self, page_lines):
+        """
+        Headings from the span metadata of one page:
+        - Noticeably larger than the document's body font, or
+        - Bold and either alone in its block or larger than body text
+        Falls back to the text heuristic when the document has no usable fonts.
+        """
+        body_size = self.font_statistics().body_size
+        if not body_size:
+            return self._text_heading_indices(page_lines)
+
+        lengths = page_lines.stripped_lengths
+        sizes = page_lines.sizes
+        bold = (page_lines.flags & SPAN_BOLD) != 0
+        isolated = page_lines.block_lines == 1
+
+        larger = sizes >= body_size * HEADING_SIZE_RATIO
+        emphasized = bold & (isolated | (sizes > body_size))
+        is_heading = (lengths > 3) & (lengths < 120) & (larger | emphasized)
+        return np.flatnonzero(is_heading).tolist()
 
     def _is_heading(self, text):
         """
@@ -57,3 +334,102 @@ class DocumentExtractor:
             re.match(r"^\d+(\.\d+)*[\).]?\s+", text) or
             (text.istitle() and 4 < len(text) < 80)
         )
+
+
+def merge_page_shards(shards, normalize_titles=False):
+    """
+    Merges candidate lists from extract_pages into the final section list.
+
+    Shards must be given in page order. The first occurrence of a title wins,
+    exactly as in a single serial pass over the document.
+    """
+    return list(deduplicate_sections(itertools.chain.from_iterable(shards), normalize_titles))
+
+
+def deduplicate_sections(candidates, normalize_titles=False):
+    """
+    Yields candidates whose title has not been seen yet.
+
+    The "language" field is detected lazily by Section when first read.
+    """
+    seen_titles = SectionTitleIndex(normalize=normalize_titles)
+    for section in candidates:
+        if seen_titles.add(section["section_title"]):  # deduplicate
+            yield section
+
+
+def release_page_store():
+    """Empties MuPDF's process-wide store of decoded pages, fonts and images."""
+    fitz.TOOLS.store_shrink(100)
+
+
+def extractor_fingerprint(options=None):
+    """
+    Identifies the extraction heuristics for cache keys.
+
+    Hashes this module's source together with EXTRACTOR_VERSION and the
+    DocumentExtractor options, so editing _is_heading (or anything else here)
+    or changing an option invalidates cached extractions.
+    """
+    try:
+        source = inspect.getsource(sys.modules[__name__])
+    except (OSError, TypeError):
+        source = ""
+    options = sorted(
+        (name, value) for name, value in (options or {}).items()
+        if name not in OUTPUT_NEUTRAL_OPTIONS
+    )
+    return hashlib.sha256(f"{EXTRACTOR_VERSION}:{options}:{source}".encode("utf-8")).hexdigest()[:16]
+
+
+def page_shards(page_count, pages_per_shard):
+    """Splits [0, page_count) into consecutive (start, stop) ranges."""
+    if pages_per_shard <= 0 or page_count <= pages_per_shard:
+        return [(0, page_count)]
+    return [
+        (start, min(start + pages_per_shard, page_count))
+        for start in range(0, page_count, pages_per_shard)
+    ]
+
+
+def count_pages(path):
+    with DocumentExtractor(path) as extractor:
+        return extractor.page_count()
+
+
+def document_font_statistics(path, **options):
+    """
+    Font statistics of a whole PDF, computed once and passed to every
+    page-range shard through extract_page_range.
+    """
+    with DocumentExtractor(path, **options) as extractor:
+        return extractor.font_statistics()
+
+
+def extract_document(path, **options):
+    """
+    Extract all sections from a single PDF.
+
+    Module-level so it can be submitted to a process pool. options are
+    passed through to DocumentExtractor.
+    """
+    with DocumentExtractor(path, **options) as extractor:
+        return extractor.extract_sections()
+
+
+def iter_document(path, **options):
+    """Stream the sections of a single PDF as its pages are parsed."""
+    with DocumentExtractor(path, **options) as extractor:
+        yield from extractor.iter_sections()
+
+
+def extract_page_range(path, start, stop, font_stats=None, **options):
+    """
+    Extract heading candidates for one page range of a PDF.
+
+    Each worker opens the file itself; combine the results with
+    merge_page_shards. Pass the document's font_stats (from
+    document_font_statistics) so the shard does not sample fonts again.
+    """
+    with DocumentExtractor(path, font_stats=font_stats, **options) as extractor:
+        return extractor.extract_pages(start, stop)
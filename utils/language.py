@@ -0,0 +1,51 @@
+from functools import lru_cache
+
+
+def _langdetect():
+    """Imports langdetect on first use and seeds it so results are repeatable."""
+    from langdetect import DetectorFactory, detect
+    DetectorFactory.seed = 0
+    return detect
+
+
+@lru_cache(maxsize=8192)
+def detect_language(text):
+    """
+    Language code for a piece of text, memoized per distinct string.
+
+    - Text of 3 characters or fewer is "unknown", as before
+    - Text with no letters (page numbers, bullets) is "unknown" without
+      running the detector, which has nothing to go on there
+    - Anything else goes through langdetect, loaded lazily on first call
+    """
+    if len(text) <= 3:
+        return "unknown"
+    if not any(char.isalpha() for char in text):
+        return "unknown"
+    try:
+        return _langdetect()(text)
+    except Exception:
+        return "unknown"
+
+
+class Section(dict):
+    """
+    Section dict whose "language" entry is only detected when first read.
+
+    The value is langdetect's guess from the section title alone, not a
+    reliable detection: short titles and place names are often misread.
+    Nothing in the default pipeline reads the language, so most runs never
+    pay for detection. Pickles and serializes like a plain dict.
+    """
+
+    def __missing__(self, key):
+        if key != "language":
+            raise KeyError(key)
+        language = detect_language(self["section_title"])
+        self["language"] = language
+        return language
+
+    def get(self, key, default=None):
+        if key == "language" and key not in self:
+            return self[key]
+        return super().get(key, default)
@@ -0,0 +1,99 @@
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from utils.ranking import top_k_indices
+
+_TOKEN = re.compile(r"\w+")
+
+# Frequent English words that carry no signal about a section's topic
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have how in is it its of on or that the
+their this to was were what which will with you your
+""".split())
+
+
+def tokenize(text):
+    """Lowercased word tokens without stopwords or single characters."""
+    return [
+        token for token in _TOKEN.findall(text.lower())
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+class BM25Index:
+    """
+    Okapi BM25 over section titles and text, backed by an inverted index.
+
+    Each term maps to the sections containing it and its frequency there, so a
+    query only touches the postings of its own terms instead of every section.
+    """
+
+    def __init__(self, sections, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        postings = defaultdict(lambda: ([], []))
+        lengths = np.zeros(len(sections), dtype=np.float32)
+        for idx, section in enumerate(sections):
+            tokens = tokenize(f"{section['section_title']} {section['text']}")
+            lengths[idx] = len(tokens)
+            for term, count in Counter(tokens).items():
+                doc_ids, frequencies = postings[term]
+                doc_ids.append(idx)
+                frequencies.append(count)
+
+        self.size = len(sections)
+        self.postings = {
+            term: (np.asarray(doc_ids, dtype=np.int64), np.asarray(frequencies, dtype=np.float32))
+            for term, (doc_ids, frequencies) in postings.items()
+        }
+        average = lengths.mean() if self.size else 0.0
+        # Per-section part of the BM25 denominator, computed once
+        self.length_norm = k1 * (1 - b + b * lengths / max(average, 1e-9))
+
+    def __len__(self):
+        return self.size
+
+    def idf(self, term):
+        doc_ids, _ = self.postings.get(term, ((), ()))
+        matches = len(doc_ids)
+        return float(np.log(1 + (self.size - matches + 0.5) / (matches + 0.5)))
+
+    def scores(self, query):
+        """BM25 score of every section for query; sections without a query term score 0."""
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term, weight in Counter(tokenize(query)).items():
+            if term not in self.postings:
+                continue
+            doc_ids, frequencies = self.postings[term]
+            tf = frequencies * (self.k1 + 1) / (frequencies + self.length_norm[doc_ids])
+            scores[doc_ids] += weight * self.idf(term) * tf
+        return scores
+
+    def top_n(self, query, n):
+        """
+        Indices and scores of the n best sections for query, best first.
+        """
+        scores = self.scores(query)
+        candidates = top_k_indices(scores, n)
+        return candidates, scores[candidates]
+
+
+def fuse_scores(dense, lexical, lexical_weight=0.3):
+    """
+    Convex combination of min-max normalised dense and lexical scores.
+
+    Both score lists must be aligned; a constant list contributes nothing.
+    """
+    return (1 - lexical_weight) * _min_max(dense) + lexical_weight * _min_max(lexical)
+
+
+def _min_max(scores):
+    scores = np.asarray(scores, dtype=np.float32)
+    if not len(scores):
+        return scores
+    spread = scores.max() - scores.min()
+    if spread <= 0:
+        return np.zeros_like(scores)
+    return (scores - scores.min()) / spread
@@ -0,0 +1,75 @@
+import re
+from collections import namedtuple
+
+import numpy as np
+
+# A token-bounded slice of one section's text: sections[section]["text"][start:end]
+Passage = namedtuple("Passage", ["section", "start", "end"])
+
+_WORD = re.compile(r"\S+")
+
+
+def _token_offsets(texts, tokenizer):
+    """(start, end) character offsets of every token in each text."""
+    if getattr(tokenizer, "is_fast", False):
+        encoded = tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+        return encoded["offset_mapping"]
+    # Slow tokenizers have no offset mapping; whitespace words are close enough
+    return [[match.span() for match in _WORD.finditer(text)] for text in texts]
+
+
+def split_passages(sections, tokenizer, max_tokens=128, overlap=16):
+    """
+    Split each section's text into passages of at most max_tokens tokens.
+
+    Consecutive passages share overlap tokens so a sentence cut at a passage
+    boundary is still seen whole by one of them. Every section gets at least
+    one passage, even when its text is empty.
+    """
+    texts = [section["text"] for section in sections]
+    if not texts:
+        return []
+    step = max(1, max_tokens - overlap)
+
+    passages = []
+    for section_idx, offsets in enumerate(_token_offsets(texts, tokenizer)):
+        if len(offsets) <= max_tokens:
+            passages.append(Passage(section_idx, 0, len(texts[section_idx])))
+            continue
+        for start in range(0, len(offsets), step):
+            window = offsets[start:start + max_tokens]
+            passages.append(Passage(section_idx, window[0][0], window[-1][1]))
+            if start + max_tokens >= len(offsets):
+                break
+    return passages
+
+
+def passage_texts(sections, passages):
+    """Texts to embed: every passage is prefixed with its section title."""
+    return [
+        f"{sections[passage.section]['section_title']} {sections[passage.section]['text'][passage.start:passage.end]}"
+        for passage in passages
+    ]
+
+
+def pool_passage_scores(scores, passage_sections, section_count, top_m=1):
+    """
+    Section scores from passage scores.
+
+    A section scores the mean of its top_m passage scores, so top_m=1 is max
+    pooling. Also returns the index of each section's best passage. Every
+    section must have at least one passage.
+    """
+    scores = np.asarray(scores, dtype=np.float32)
+    passage_sections = np.asarray(passage_sections, dtype=np.int64)
+
+    # Group passages by section, best first within each group
+    order = np.lexsort((-scores, passage_sections))
+    grouped = passage_sections[order]
+    group_starts = np.searchsorted(grouped, np.arange(section_count))
+    rank_in_group = np.arange(len(order)) - group_starts[grouped]
+
+    kept = order[rank_in_group < top_m]
+    totals = np.bincount(passage_sections[kept], weights=scores[kept], minlength=section_count)
+    counts = np.bincount(passage_sections[kept], minlength=section_count)
+    return (totals / np.maximum(counts, 1)).astype(np.float32), order[group_starts]
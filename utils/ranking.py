@@ -0,0 +1,24 @@
+import numpy as np
+
+
+def top_k_indices(scores, k):
+    """
+    Indices of the k highest scores, best first, in O(n + k log k).
+
+    Ties are broken by the lower index first, which matches what a stable
+    descending sort of the whole list produces.
+    """
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k == n:
+        chosen = np.arange(n)
+    else:
+        # argpartition picks arbitrarily among scores equal to the k-th best,
+        # so take everything above it and fill up with the lowest-index ties
+        threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        above = np.flatnonzero(scores > threshold)
+        ties = np.flatnonzero(scores == threshold)[:k - len(above)]
+        chosen = np.concatenate([above, ties])
+    return chosen[np.lexsort((chosen, -scores[chosen]))]
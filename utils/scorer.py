@@ -1,11 +1,117 @@
-from sentence_transformers import SentenceTransformer, util
+import copy
+import weakref
+
+import numpy as np
+import torch
+from sentence_transformers import util
+
+from utils.cache import normalize_text
+from utils.ann import ANN_INDEX_TYPES, load_or_build
+from utils.encode_pool import EncodePool
+from utils.encoders import load_encoder
+from utils.lexical import BM25Index, fuse_scores
+from utils.passages import passage_texts, pool_passage_scores, split_passages
+from utils.ranking import top_k_indices
+
+
+class RankedSections:
+    """
+    Lazy cursor over sections in descending score order.
+
+    Scores are computed once; take() selects the next ranks from the score
+    vector without re-encoding or sorting everything. Only sections that are
+    returned get a 'score' entry (and a 'best_passage' (start, end) text
+    offset when sections were scored by passage).
+    """
+
+    def __init__(self, sections, scores, best_passages=None):
+        self.sections = sections
+        self.scores = np.asarray(scores)
+        self.best_passages = best_passages
+        self.position = 0
+
+    def __len__(self):
+        return len(self.sections)
+
+    def take(self, n):
+        """Returns the next n ranked sections (fewer once the ranking is exhausted)."""
+        stop = min(self.position + n, len(self.sections))
+        selected = self.rank_range(self.position, stop)
+        self.position = stop
+        return selected
+
+    def rank_range(self, start, stop):
+        """Sections at ranks [start, stop), best first; does not move the cursor."""
+        ranked = []
+        for idx in top_k_indices(self.scores, stop)[start:].tolist():
+            section = self.sections[idx]
+            section['score'] = float(self.scores[idx])
+            if self.best_passages is not None:
+                section['best_passage'] = self.best_passages[idx]
+            ranked.append(section)
+        return ranked
+
+    def __iter__(self):
+        while self.position < len(self.sections):
+            yield from self.take(max(1, self.position))
+
 
 class SectionScorer:
-    def __init__(self):
-        # Load the pre-trained sentence transformer model
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+    def __init__(self, model_name='all-MiniLM-L6-v2', embedding_cache=None, batch_size=32,
+                 max_seq_length=None, backend='torch', onnx_dir=None,
+                 lexical_top_n=0, lexical_weight=0.3, ann_index='exact',
+                 ann_exact_threshold=50000, ann_index_dir=None, passage_tokens=0,
+                 passage_top_m=1, encode_workers=0, threads_per_worker=None):
+        # Checked up front: below ann_exact_threshold a bad value would
+        # otherwise pass silently, above it fail only at ranking time
+        if ann_index not in ANN_INDEX_TYPES:
+            raise ValueError(f"Unknown ANN index type: {ann_index}")
+        # Load the pre-trained sentence transformer model (PyTorch or ONNX Runtime)
+        self.model = load_encoder(backend, model_name, onnx_dir)
+        # Texts per forward pass. encode() sorts texts by length before
+        # batching and restores the input order, so each batch is padded only
+        # to the longest text in its own length bucket.
+        self.batch_size = batch_size
+        # Token cap per text; None keeps the model's default (256 for MiniLM)
+        if max_seq_length:
+            self.model.max_seq_length = int(max_seq_length)
+        # Embeddings differ slightly between backends and entirely between
+        # truncation lengths, so cache them apart
+        self.model_name = f"{model_name}:{backend}:{self.model.max_seq_length}"
+        # Optional EmbeddingCache; only cache misses are sent to the model
+        self.embedding_cache = embedding_cache
+        # Keep only the BM25 top-N sections for dense scoring; 0 disables
+        self.lexical_top_n = lexical_top_n
+        # Share of the fused score that comes from BM25
+        self.lexical_weight = lexical_weight
+        # "hnsw", "ivf", "int8" or "binary" search the top-k approximately once there are at
+        # least ann_exact_threshold sections; built indexes are kept in ann_index_dir
+        self.ann_index = ann_index
+        self.ann_exact_threshold = ann_exact_threshold
+        self.ann_index_dir = ann_index_dir
+        self._section_index = (None, None)
+        # Score sections by passages of at most passage_tokens tokens (0
+        # embeds each section whole); a section scores the mean of its
+        # passage_top_m best passages, so 1 is max pooling
+        self.passage_tokens = passage_tokens
+        self.passage_top_m = passage_top_m
+        # Bulk encoding is sharded across this many persistent worker
+        # processes (0 encodes in-process); queries and small batches stay
+        # in-process
+        self.encode_pool = None
+        if encode_workers >= 1:
+            self.encode_pool = EncodePool(
+                encode_workers, threads_per_worker, backend=backend, model_name=model_name,
+                onnx_dir=onnx_dir, max_seq_length=max_seq_length
+            )
+
+    def close(self):
+        """Stops the encode pool, if any. Safe to call twice."""
+        if self.encode_pool is not None:
+            self.encode_pool.close()
+            self.encode_pool = None
 
-    def rank_sections(self, sections, persona, job_description):
+    def rank_sections(self, sections, persona, job_description, top_k=None):
         """
         Rank document sections by relevance to a persona and their job description.
 
@@ -13,31 +119,249 @@ class SectionScorer:
             sections (list): List of section dicts with keys: section_title, text, etc.
             persona (str): Persona description
             job_description (str): Task to be done
+            top_k (int, optional): Only select and return the k best sections
 
         Returns:
             List of sections ranked by relevance (high to low)
         """
 
+        if self.passage_tokens or (self.lexical_top_n and len(sections) > self.lexical_top_n):
+            cursor = self.rank_cursor(sections, persona, job_description)
+            return cursor.take(len(cursor) if top_k is None else top_k)
+
+        # Encode all sections
+        section_embeddings = self.encode_sections(sections)
+
+        return self.rank_encoded(sections, section_embeddings, persona, job_description, top_k)
+
+    def rank_cursor(self, sections, persona, job_description):
+        """
+        Score sections once and return a RankedSections cursor, so callers can
+        fetch further ranks later without rescoring.
+
+        With lexical_top_n set, only the BM25 top-N sections are encoded and
+        the cursor ranks those by the fused BM25 + dense score.
+        """
+        if self.lexical_top_n and len(sections) > self.lexical_top_n:
+            return self.cursor_prefiltered(sections, persona, job_description)
+        return self.cursor_dense(sections, persona, job_description)
+
+    def cursor_dense(self, sections, persona, job_description):
+        if self.passage_tokens:
+            return self.cursor_passages(sections, persona, job_description)
+
+        # Encode all sections
+        section_embeddings = self.encode_sections(sections)
+        return self.cursor_encoded(sections, section_embeddings, persona, job_description)
+
+    def cursor_prefiltered(self, sections, persona, job_description):
+        index = BM25Index(sections)
+        candidates, lexical_scores = index.top_n(f"{persona} {job_description}", self.lexical_top_n)
+        candidate_sections = [sections[idx] for idx in candidates.tolist()]
+
+        dense = self.cursor_dense(candidate_sections, persona, job_description)
+        return RankedSections(
+            candidate_sections, fuse_scores(dense.scores, lexical_scores, self.lexical_weight),
+            dense.best_passages
+        )
+
+    def cursor_passages(self, sections, persona, job_description):
+        """
+        Rank sections by their best passages, so text beyond the encoder's
+        token limit still counts.
+        """
+        passages, passage_embeddings = self.encode_passages(sections)
+        query_embedding = self.model.encode(self.query_text(persona, job_description), convert_to_tensor=True)
+        passage_scores = util.pytorch_cos_sim(query_embedding, passage_embeddings)[0].cpu().numpy()
+        return self._pool_passages(sections, passages, passage_scores)
+
+    def encode_passages(self, sections):
+        """Split sections into passages and embed them; returns (passages, embeddings)."""
+        passages = split_passages(sections, self.model.tokenizer, self.passage_tokens)
+        return passages, self.encode_texts(passage_texts(sections, passages))
+
+    def _pool_passages(self, sections, passages, passage_scores):
+        scores, best = pool_passage_scores(
+            passage_scores, [passage.section for passage in passages], len(sections), self.passage_top_m
+        )
+        best_passages = [(passages[idx].start, passages[idx].end) for idx in best.tolist()]
+        return RankedSections(sections, scores, best_passages)
+
+    def encode_sections(self, sections):
+        """
+        Embed a batch of sections. Can be called on micro-batches as sections
+        are extracted and the results combined with join_embeddings.
+        """
+
         # Combine heading + body for embeddings
         section_texts = [
             f"{sec['section_title']} {sec['text']}" for sec in sections
         ]
 
+        return self.encode_texts(section_texts)
+
+    def encode_texts(self, texts):
+        """
+        Embed texts, reusing cached embeddings when an embedding cache is set.
+        """
+        if self.embedding_cache is None or not texts:
+            if self._use_pool(texts):
+                return torch.from_numpy(self.encode_pool.encode(texts, self.batch_size)).to(self.model.device)
+            return self.model.encode(texts, batch_size=self.batch_size, convert_to_tensor=True)
+
+        texts = [normalize_text(text) for text in texts]
+        embeddings = self.embedding_cache.get_many(self.model_name, texts)
+        misses = list(dict.fromkeys(text for text in texts if text not in embeddings))
+        if misses:
+            if self._use_pool(misses):
+                encoded = self.encode_pool.encode(misses, self.batch_size)
+            else:
+                encoded = self.model.encode(misses, batch_size=self.batch_size, convert_to_numpy=True)
+            self.embedding_cache.put_many(self.model_name, zip(misses, encoded))
+            embeddings.update(zip(misses, encoded))
+
+        stacked = np.stack([embeddings[text] for text in texts]).astype(np.float32, copy=False)
+        return torch.from_numpy(stacked).to(self.model.device)
+
+    def _use_pool(self, texts):
+        # Below a couple of batches per worker, process overhead outweighs the gain
+        return self.encode_pool is not None and len(texts) >= 2 * self.batch_size * self.encode_pool.workers
+
+    @staticmethod
+    def join_embeddings(batches, keep=None):
+        """
+        Concatenate micro-batch embeddings, optionally keeping only the rows
+        whose indices are listed in keep.
+        """
+        embeddings = torch.cat(batches)
+        if keep is not None:
+            embeddings = embeddings[torch.as_tensor(keep, dtype=torch.long, device=embeddings.device)]
+        return embeddings
+
+    def rank_encoded(self, sections, section_embeddings, persona, job_description, top_k=None):
+        """
+        Rank sections whose embeddings were already computed by encode_sections.
+
+        Args:
+            sections (list): Section dicts, aligned with section_embeddings rows
+            section_embeddings (Tensor): One embedding per section
+            persona (str): Persona description
+            job_description (str): Task to be done
+            top_k (int, optional): Only select and return the k best sections
+
+        Returns:
+            List of sections ranked by relevance (high to low)
+        """
+        if top_k is not None and self.uses_ann(len(sections)):
+            query_embedding = self.model.encode(
+                self.query_text(persona, job_description), convert_to_numpy=True
+            )
+            return self.search_index(sections, section_embeddings, query_embedding, top_k)[0]
+
+        cursor = self.cursor_encoded(sections, section_embeddings, persona, job_description)
+        return cursor.take(len(sections) if top_k is None else top_k)
+
+    def uses_ann(self, section_count):
+        return self.ann_index != 'exact' and section_count >= self.ann_exact_threshold
+
+    def section_index(self, section_embeddings):
+        """ANN index over section_embeddings, built (or loaded) once per embedding matrix."""
+        embeddings_ref, section_index = self._section_index
+        if embeddings_ref is None or embeddings_ref() is not section_embeddings:
+            section_index = load_or_build(
+                section_embeddings.cpu().numpy(), self.ann_index_dir,
+                index_type=self.ann_index, exact_threshold=self.ann_exact_threshold
+            )
+            # A weak reference, so the float embeddings are freed with the
+            # caller's copy instead of living as long as the scorer
+            self._section_index = (weakref.ref(section_embeddings), section_index)
+        return section_index
+
+    def search_index(self, sections, section_embeddings, query_embeddings, top_k, copy_sections=False):
+        """
+        Approximate top-k sections for each query embedding via the ANN index.
+        Returns one ranked list per query.
+        """
+        scores, ids = self.section_index(section_embeddings).search(query_embeddings, top_k)
+        rankings = []
+        for row_scores, row_ids in zip(scores.tolist(), ids.tolist()):
+            ranked = []
+            for score, idx in zip(row_scores, row_ids):
+                if idx < 0:
+                    continue
+                section = copy.copy(sections[idx]) if copy_sections else sections[idx]
+                section['score'] = float(score)
+                ranked.append(section)
+            rankings.append(ranked)
+        return rankings
+
+    def rank_sections_multi(self, sections, queries, top_k=20):
+        """
+        Rank one shared set of sections for many persona/job pairs.
+
+        Args:
+            sections (list): Section dicts shared by all queries
+            queries (list): (persona, job_description) tuples
+            top_k (int): Sections to return per query
+
+        Returns:
+            One ranked list per query. Entries are shallow copies of the
+            sections, so each query's 'score' values stay separate.
+        """
+        if self.passage_tokens:
+            passages, passage_embeddings = self.encode_passages(sections)
+            query_embeddings = self.model.encode(
+                [self.query_text(persona, job_description) for persona, job_description in queries],
+                batch_size=self.batch_size, convert_to_tensor=True
+            )
+            similarities = util.pytorch_cos_sim(query_embeddings, passage_embeddings).cpu().numpy()
+            rankings = []
+            for passage_scores in similarities:
+                cursor = self._pool_passages(sections, passages, passage_scores)
+                rankings.append(self._ranked_copies(sections, cursor.scores, top_k, cursor.best_passages))
+            return rankings
+
+        section_embeddings = self.encode_sections(sections)
+        return self.rank_encoded_multi(sections, section_embeddings, queries, top_k)
+
+    def rank_encoded_multi(self, sections, section_embeddings, queries, top_k=20):
+        """
+        rank_sections_multi for sections already embedded by encode_sections.
+        All queries are encoded in one batch and scored with a single
+        (queries x sections) matrix multiply.
+        """
+        query_texts = [self.query_text(persona, job_description) for persona, job_description in queries]
+        if self.uses_ann(len(sections)):
+            query_embeddings = self.model.encode(query_texts, batch_size=self.batch_size, convert_to_numpy=True)
+            return self.search_index(sections, section_embeddings, query_embeddings, top_k, copy_sections=True)
+
+        query_embeddings = self.model.encode(query_texts, batch_size=self.batch_size, convert_to_tensor=True)
+        similarities = util.pytorch_cos_sim(query_embeddings, section_embeddings).cpu().numpy()
+        return [self._ranked_copies(sections, scores, top_k) for scores in similarities]
+
+    @staticmethod
+    def _ranked_copies(sections, scores, top_k, best_passages=None):
+        # Shallow copies, so rankings for different queries keep their own scores
+        ranked = []
+        for idx in top_k_indices(scores, top_k).tolist():
+            section = copy.copy(sections[idx])
+            section['score'] = float(scores[idx])
+            if best_passages is not None:
+                section['best_passage'] = best_passages[idx]
+            ranked.append(section)
+        return ranked
+
+    @staticmethod
+    def query_text(persona, job_description):
+        # Combined persona + job query
+        return f"Persona: {persona}. Job: {job_description}"
+
+    def cursor_encoded(self, sections, section_embeddings, persona, job_description):
         # Create a query embedding for the combined persona + job
-        query = f"Persona: {persona}. Job: {job_description}"
+        query = self.query_text(persona, job_description)
         query_embedding = self.model.encode(query, convert_to_tensor=True)
 
-        # Encode all sections
-        section_embeddings = self.model.encode(section_texts, convert_to_tensor=True)
-
         # Compute cosine similarity scores
         similarities = util.pytorch_cos_sim(query_embedding, section_embeddings)[0]
 
-        # Attach scores to each section
-        for idx, score in enumerate(similarities):
-            sections[idx]['score'] = float(score)
-
-        # Sort the sections in descending order of relevance
-        ranked_sections = sorted(sections, key=lambda x: x['score'], reverse=True)
-
-        return ranked_sections
+        return RankedSections(sections, similarities.cpu().numpy())
@@ -1,11 +1,81 @@
-from transformers import pipeline
-from typing import List, Dict
+import re
+
+import numpy as np
+from typing import List, Dict, Optional, Tuple
+
+from utils.cache import SummaryCache
+from utils.lexical import tokenize
+from utils.summary_backends import DEFAULT_SUMMARY_MODEL, load_summarization_pipeline
+
+SUMMARY_ENGINES = ("abstractive", "extractive")
+# How the persona and job are put in front of the section text
+PERSONA_PROMPTS = ("full", "compact", "none")
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def section_contents(sections: List[Dict]) -> List[Tuple[str, int, str]]:
+    """
+    (document, page, content) for each section worth summarizing, in order.
+
+    Skips near-empty and duplicate sections, and starts from the best passage
+    when the scorer recorded one.
+    """
+    contents = []
+    seen = set()
+    for section in sections:
+        try:
+            content = section.get("text", "")
+            doc = section.get("document", "unknown")
+            page = section.get("page_number", 0)
+            if "best_passage" in section:
+                # Start from the passage the scorer matched best
+                content = content[section["best_passage"][0]:]
+            content = content.strip()
+
+            if not content or len(content) < 10:
+                continue
+
+            # Avoid duplicates
+            dedup_key = (doc, page, content)
+            if dedup_key in seen:
+                continue
+            seen.add(dedup_key)
+            contents.append((doc, page, content))
+        except Exception as e:
+            print(f"   ✗ Error summarizing section from {doc} (page {page}): {e}")
+            continue
+    return contents
 
 
 class SubSectionSummarizer:
-    def __init__(self):
-        # Lightweight summarization model (under 500MB)
-        self.summarizer = pipeline("summarization", model="sshleifer/distilbart-cnn-12-6")
+    def __init__(self, batch_size: int = 4, cache: Optional[SummaryCache] = None,
+                 input_tokens: int = 256, persona_prompt: str = "compact", backend: str = "torch",
+                 onnx_dir: Optional[str] = None, model_name: str = DEFAULT_SUMMARY_MODEL):
+        if persona_prompt not in PERSONA_PROMPTS:
+            raise ValueError(f"Unknown persona prompt: {persona_prompt}")
+        # Lightweight summarization model (under 500MB), in PyTorch fp32,
+        # PyTorch int8 or ONNX Runtime
+        self.summarizer = load_summarization_pipeline(backend, model_name, onnx_dir)
+        # Backends word summaries slightly differently, so cache them apart
+        self.model_name = model_name if backend == "torch" else f"{model_name}:{backend}"
+        # Inputs per generate() call; inputs are length-sorted so each batch
+        # is padded only to similar lengths
+        self.batch_size = max(1, batch_size)
+        self.generation_kwargs = {"max_length": 160, "min_length": 40, "do_sample": False}
+        # Optional SummaryCache; only misses are generated
+        self.cache = cache
+        # DistilBART is not instruction-tuned, so prompt text gets summarized
+        # along with the section; "compact" keeps it to one short line
+        self.persona_prompt = persona_prompt
+        # Token budget per model input (special tokens included), capped at
+        # what the model accepts so the pipeline never truncates silently
+        self.tokenizer = self.summarizer.tokenizer
+        model_max = min(
+            self.tokenizer.model_max_length,
+            getattr(self.summarizer.model.config, "max_position_embeddings", self.tokenizer.model_max_length)
+        )
+        self.input_tokens = min(input_tokens, model_max) if input_tokens else model_max
 
     def extract_subsections(self, sections: List[Dict], persona: str, job_description: str) -> List[Dict]:
         """
@@ -19,52 +89,230 @@ class SubSectionSummarizer:
         Returns:
             list: Refined summaries with metadata.
         """
-        sub_analysis = []
-        seen = set()
+        conditioning = self._conditioning(persona, job_description)
+        query_terms = set(tokenize(f"{persona} {job_description}"))
+        pending = [
+            (doc, page, self.build_input(content, conditioning, query_terms))
+            for doc, page, content in section_contents(sections)
+        ]
+
+        summaries = self._cached_summaries(pending, persona, job_description)
+
+        return [
+            {
+                "document": doc,
+                "page_number": page,
+                "refined_text": summary
+            }
+            for (doc, page, _), summary in zip(pending, summaries)
+            if summary is not None
+        ]
+
+    def _conditioning(self, persona: str, job_description: str) -> str:
+        if self.persona_prompt == "full":
+            return (
+                f"You are assisting a persona: {persona}.\n"
+                f"The task is: {job_description}.\n"
+                f"Summarize the section focusing on what's most relevant.\n\n"
+            )
+        if self.persona_prompt == "compact":
+            return f"{persona}: {job_description}\n"
+        return ""
+
+    def count_tokens(self, text: str) -> int:
+        """Tokens the model sees for text, special tokens included."""
+        return len(self.tokenizer(text)["input_ids"])
+
+    def fit_conditioning(self, conditioning: str) -> str:
+        """conditioning cut to at most half of input_tokens, so the section keeps the rest."""
+        limit = self.input_tokens // 2
+        if self.count_tokens(conditioning) <= limit:
+            return conditioning
+        ids = self.tokenizer(conditioning, add_special_tokens=False)["input_ids"]
+        for stop in range(min(limit, len(ids)), 0, -1):
+            fitted = self.tokenizer.decode(ids[:stop]).rstrip() + "\n"
+            if self.count_tokens(fitted) <= limit:
+                return fitted
+        return ""
 
-        system_prompt = (
-            f"You are assisting a persona: {persona}.\n"
-            f"The task is: {job_description}.\n"
-            f"Summarize the section focusing on what's most relevant."
+    def build_input(self, content: str, conditioning: str, query_terms: set) -> str:
+        """
+        Model input of at most input_tokens tokens: the conditioning line
+        (cut by fit_conditioning when it is long), then the section sentences
+        sharing the most words with the persona and job (earlier sentences
+        first on ties), in document order.
+        """
+        conditioning = self.fit_conditioning(conditioning)
+        budget = self.input_tokens - self.count_tokens(conditioning)
+        sentences = split_sentences(content) or [content]
+        lengths = [len(ids) for ids in self.tokenizer(sentences, add_special_tokens=False)["input_ids"]]
+        by_value = sorted(
+            range(len(sentences)),
+            key=lambda i: (-len(query_terms.intersection(tokenize(sentences[i]))), i)
         )
 
-        for section in sections:
-            try:
-                content = section.get("text", "").strip()
-                doc = section.get("document", "unknown")
-                page = section.get("page_number", 0)
+        chosen = []
+        used = 0
+        for i in by_value:
+            if used + lengths[i] <= budget:
+                chosen.append(i)
+                used += lengths[i]
 
-                if not content or len(content) < 10:
-                    continue
+        while chosen:
+            model_input = conditioning + " ".join(sentences[i] for i in sorted(chosen))
+            # Joining can tokenize slightly differently from the parts; drop
+            # the least valuable sentence until it fits
+            if self.count_tokens(model_input) <= self.input_tokens:
+                return model_input
+            chosen.pop()
+
+        # Not even the best sentence fits: cut it at the budget, shorter still
+        # if decoding and re-tokenizing the cut adds tokens
+        ids = self.tokenizer(sentences[by_value[0]], add_special_tokens=False)["input_ids"]
+        for stop in range(min(budget, len(ids)), 0, -1):
+            model_input = conditioning + self.tokenizer.decode(ids[:stop])
+            if self.count_tokens(model_input) <= self.input_tokens:
+                return model_input
+        return conditioning
 
-                # Avoid duplicates
-                dedup_key = (doc, page, content)
-                if dedup_key in seen:
+    def _cached_summaries(self, pending: List[tuple], persona: str, job_description: str) -> List[Optional[str]]:
+        if self.cache is None:
+            return self._summarize_batches(pending)
+
+        keys = [
+            self.cache.key(self.model_name, self.generation_kwargs, persona, job_description, model_input)
+            for _, _, model_input in pending
+        ]
+        summaries = [self.cache.load(key) for key in keys]
+        misses = [i for i, summary in enumerate(summaries) if summary is None]
+        if misses:
+            generated = self._summarize_batches([pending[i] for i in misses])
+            for i, summary in zip(misses, generated):
+                if summary is not None:
+                    self.cache.store(keys[i], summary)
+                    summaries[i] = summary
+        print(f"   Summaries: {len(pending) - len(misses)} cached, {len(misses)} generated")
+        return summaries
+
+    def _summarize_batches(self, pending: List[tuple]) -> List[Optional[str]]:
+        """
+        Summaries for the (doc, page, input) entries in pending, in order;
+        None where summarization failed.
+        """
+        summaries = [None] * len(pending)
+        order = sorted(range(len(pending)), key=lambda i: len(pending[i][2]), reverse=True)
+
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            try:
+                outputs = self.summarizer(
+                    [pending[i][2] for i in batch], batch_size=len(batch), truncation=True,
+                    **self.generation_kwargs
+                )
+            except Exception as e:
+                if len(batch) == 1:
+                    doc, page, _ = pending[batch[0]]
+                    print(f"   ✗ Error summarizing section from {doc} (page {page}): {e}")
                     continue
-                seen.add(dedup_key)
+                # Retry one by one so a single bad section does not cost the whole batch
+                outputs = [self._summarize_one(pending[i]) for i in batch]
+
+            for i, output in zip(batch, outputs):
+                if output is not None:
+                    summaries[i] = output["summary_text"].strip()
+
+        return summaries
+
+    def _summarize_one(self, entry: tuple) -> Optional[Dict]:
+        doc, page, combined_input = entry
+        try:
+            return self.summarizer(combined_input, truncation=True, **self.generation_kwargs)[0]
+        except Exception as e:
+            print(f"   ✗ Error summarizing section from {doc} (page {page}): {e}")
+            return None
+
 
-                # Truncate intelligently to ~1000 chars with sentence boundary
-                if len(content) > 1000:
-                    truncated = content[:1000].rsplit('.', 1)[0]
-                    content = truncated + '.' if truncated else content[:1000]
+class ExtractiveSummarizer:
+    """
+    Picks the sentences of each section closest to the persona/job query,
+    using maximal marginal relevance so the picks do not repeat each other.
 
-                # Combine context + content
-                combined_input = system_prompt + "\n\n" + content
+    Sentences are embedded with the scorer's model (and embedding cache), so
+    no second model is loaded. Much faster than generation, less fluent.
+    """
 
-                summary = self.summarizer(
-                    combined_input,
-                    max_length=160,
-                    min_length=40,
-                    do_sample=False
-                )[0]["summary_text"].strip()
+    def __init__(self, scorer, max_sentences: int = 3, mmr_lambda: float = 0.7):
+        self.scorer = scorer
+        self.max_sentences = max_sentences
+        # 1 ranks by relevance only; lower values favour diverse sentences
+        self.mmr_lambda = mmr_lambda
 
+    def extract_subsections(self, sections: List[Dict], persona: str, job_description: str) -> List[Dict]:
+        """Same interface and output shape as SubSectionSummarizer.extract_subsections."""
+        contents = section_contents(sections)
+        sentence_lists = [split_sentences(content) for _, _, content in contents]
+        all_sentences = [sentence for sentences in sentence_lists for sentence in sentences]
+        if not all_sentences:
+            return []
+
+        # One encoder call for every sentence of every section
+        embeddings = self.scorer.encode_texts(all_sentences).cpu().numpy()
+        embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        query = self.scorer.model.encode(
+            self.scorer.query_text(persona, job_description), convert_to_numpy=True
+        )
+        query = query / max(np.linalg.norm(query), 1e-12)
+
+        sub_analysis = []
+        start = 0
+        for (doc, page, _), sentences in zip(contents, sentence_lists):
+            section_embeddings = embeddings[start:start + len(sentences)]
+            start += len(sentences)
+            try:
+                chosen = mmr_select(section_embeddings, query, self.max_sentences, self.mmr_lambda)
                 sub_analysis.append({
                     "document": doc,
                     "page_number": page,
-                    "refined_text": summary
+                    # Keep the document's sentence order
+                    "refined_text": " ".join(sentences[i] for i in sorted(chosen))
                 })
             except Exception as e:
                 print(f"   ✗ Error summarizing section from {doc} (page {page}): {e}")
                 continue
-
         return sub_analysis
+
+
+def split_sentences(text: str) -> List[str]:
+    """Sentences of text; very short fragments are merged into the previous sentence."""
+    sentences = []
+    for sentence in _SENTENCE_END.split(text):
+        # Bullet glyphs from list items carry no content
+        sentence = sentence.strip().lstrip("•▪◦ ")
+        if not sentence:
+            continue
+        if sentences and len(sentence) < 20:
+            sentences[-1] += " " + sentence
+        else:
+            sentences.append(sentence)
+    return sentences
+
+
+def mmr_select(embeddings: np.ndarray, query: np.ndarray, count: int, mmr_lambda: float) -> List[int]:
+    """
+    Indices of up to count rows chosen by maximal marginal relevance over
+    L2-normalised embeddings.
+    """
+    relevance = embeddings @ query
+    similarity = embeddings @ embeddings.T
+    chosen = []
+    candidates = list(range(len(embeddings)))
+    while candidates and len(chosen) < count:
+        if chosen:
+            redundancy = similarity[np.ix_(candidates, chosen)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(candidates))
+        scores = mmr_lambda * relevance[candidates] - (1 - mmr_lambda) * redundancy
+        best = candidates[int(np.argmax(scores))]
+        chosen.append(best)
+        candidates.remove(best)
+    return chosen
@@ -0,0 +1,194 @@
+"""
+Pluggable generation backends for SubSectionSummarizer.
+
+- "torch": the DistilBART pipeline in full precision (default)
+- "torch-int8": the same model with its Linear layers dynamically
+  quantized to int8
+- "onnx": the model exported to ONNX (encoder, decoder and decoder with
+  past key/values) and run with ONNX Runtime through optimum, reusing the
+  KV-cache between decoding steps
+
+Every backend returns a transformers summarization pipeline, so the
+summarizer's batching, budgeting and caching work unchanged.
+
+Export once, then compare summaries with the fp32 baseline:
+
+    python -m utils.summary_backends export --output models/distilbart-onnx
+    python -m utils.summary_backends parity --backend onnx --onnx-dir models/distilbart-onnx
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+import torch
+
+SUMMARY_BACKENDS = ("torch", "torch-int8", "onnx")
+
+DEFAULT_SUMMARY_MODEL = "sshleifer/distilbart-cnn-12-6"
+
+
+def _ort_seq2seq():
+    try:
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    except ImportError as e:
+        raise ImportError(
+            "The onnx summary backend needs optimum and onnxruntime: pip install optimum[onnxruntime]"
+        ) from e
+    return ORTModelForSeq2SeqLM
+
+
+def load_summarization_pipeline(backend="torch", model_name=DEFAULT_SUMMARY_MODEL, onnx_dir=None):
+    if backend not in SUMMARY_BACKENDS:
+        raise ValueError(f"Unknown summary backend: {backend}")
+    from transformers import AutoModelForSeq2SeqLM, AutoTokenizer, pipeline
+
+    if backend == "torch":
+        return pipeline("summarization", model=model_name)
+    if backend == "torch-int8":
+        model = AutoModelForSeq2SeqLM.from_pretrained(model_name).eval()
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return pipeline("summarization", model=model, tokenizer=AutoTokenizer.from_pretrained(model_name))
+    if not onnx_dir:
+        raise ValueError("The onnx summary backend needs onnx_dir (run `python -m utils.summary_backends export` first)")
+    model = _ort_seq2seq().from_pretrained(onnx_dir, use_cache=True)
+    return pipeline("summarization", model=model, tokenizer=AutoTokenizer.from_pretrained(onnx_dir))
+
+
+def export_onnx(model_name, output_dir):
+    """Export model_name to ONNX in output_dir, with a decoder that takes past key/values."""
+    from transformers import AutoTokenizer
+
+    model = _ort_seq2seq().from_pretrained(model_name, export=True, use_cache=True)
+    model.save_pretrained(output_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(output_dir)
+
+
+_WORD = re.compile(r"\w+")
+
+
+def _rouge_tokens(text):
+    return _WORD.findall(text.lower())
+
+
+def _f1(overlap, reference_count, candidate_count):
+    if not reference_count and not candidate_count:
+        # Two empty texts agree
+        return 1.0
+    if not overlap:
+        return 0.0
+    precision = overlap / candidate_count
+    recall = overlap / reference_count
+    return 2 * precision * recall / (precision + recall)
+
+
+def rouge_n(reference, candidate, n=1):
+    """ROUGE-N F1 between two texts."""
+    def grams(tokens):
+        return Counter(tuple(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+
+    reference_grams = grams(_rouge_tokens(reference))
+    candidate_grams = grams(_rouge_tokens(candidate))
+    overlap = sum((reference_grams & candidate_grams).values())
+    return _f1(overlap, sum(reference_grams.values()), sum(candidate_grams.values()))
+
+
+def rouge_l(reference, candidate):
+    """ROUGE-L F1 (longest common subsequence) between two texts."""
+    reference_tokens = _rouge_tokens(reference)
+    candidate_tokens = _rouge_tokens(candidate)
+    previous = [0] * (len(candidate_tokens) + 1)
+    for reference_token in reference_tokens:
+        current = [0]
+        for j, candidate_token in enumerate(candidate_tokens):
+            if reference_token == candidate_token:
+                current.append(previous[j] + 1)
+            else:
+                current.append(max(previous[j + 1], current[j]))
+        previous = current
+    return _f1(previous[-1], len(reference_tokens), len(candidate_tokens))
+
+
+def parity_check(sections, persona, job_description, backend, model_name=DEFAULT_SUMMARY_MODEL,
+                 onnx_dir=None):
+    """
+    Summarize sections with the fp32 baseline and with backend.
+
+    Returns mean ROUGE-1 / ROUGE-L F1 of the backend's summaries against the
+    baseline's, and the time each took.
+    """
+    from utils.summarizer import SubSectionSummarizer
+
+    timings = {}
+    summaries = {}
+    for name, options in (("torch", {}), (backend, {"backend": backend, "onnx_dir": onnx_dir})):
+        summarizer = SubSectionSummarizer(model_name=model_name, **options)
+        start = time.perf_counter()
+        results = summarizer.extract_subsections(sections, persona, job_description)
+        timings[name] = time.perf_counter() - start
+        summaries[name] = {(r["document"], r["page_number"]): r["refined_text"] for r in results}
+
+    pairs = [
+        (reference, summaries[backend][key])
+        for key, reference in summaries["torch"].items() if key in summaries[backend]
+    ]
+    count = max(len(pairs), 1)
+    return {
+        "sections": len(pairs),
+        "rouge1": sum(rouge_n(reference, candidate) for reference, candidate in pairs) / count,
+        "rougeL": sum(rouge_l(reference, candidate) for reference, candidate in pairs) / count,
+        "baseline_seconds": timings["torch"],
+        "backend_seconds": timings[backend]
+    }
+
+
+def _sample_sections(input_dir, limit):
+    from utils.extractor import extract_document
+
+    sections = []
+    for pdf_path in sorted(glob.glob(os.path.join(input_dir, "*.pdf"))):
+        sections.extend(extract_document(pdf_path))
+        if len(sections) >= limit:
+            break
+    return sections[:limit]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export and check summarization backends")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Export the summarizer to ONNX with KV-cache")
+    export.add_argument("--model", default=DEFAULT_SUMMARY_MODEL)
+    export.add_argument("--output", required=True)
+
+    parity = commands.add_parser("parity", help="Report ROUGE of a backend's summaries against fp32")
+    parity.add_argument("--backend", choices=SUMMARY_BACKENDS[1:], required=True)
+    parity.add_argument("--model", default=DEFAULT_SUMMARY_MODEL)
+    parity.add_argument("--onnx-dir")
+    parity.add_argument("--input", default="input", help="Directory of PDFs to sample sections from")
+    parity.add_argument("--limit", type=int, default=10)
+    parity.add_argument("--persona", default="Research Analyst")
+    parity.add_argument("--job", default="Analyze documents and extract insights")
+
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        export_onnx(args.model, args.output)
+        print(f"Exported {args.model} to {args.output}")
+        return 0
+
+    sections = _sample_sections(args.input, args.limit)
+    if not sections:
+        print(f"No sections found in {args.input}")
+        return 1
+    report = parity_check(sections, args.persona, args.job, args.backend, args.model, args.onnx_dir)
+    print(f"{args.backend}: {report['sections']} sections, ROUGE-1 {report['rouge1']:.3f}, "
+          f"ROUGE-L {report['rougeL']:.3f}, {report['backend_seconds']:.1f}s "
+          f"(fp32 {report['baseline_seconds']:.1f}s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())